@@ -1,9 +1,13 @@
 #!/usr/bin/python3
 
+import datetime
+import functools
 import gc
 import os
 import sys
 import time
+import tracemalloc
+from io import StringIO
 from operator import itemgetter
 
 
@@ -11,10 +15,17 @@ pkgdir = os.path.join(os.path.dirname(__file__), 'src')
 sys.path.insert(0, pkgdir)
 
 from gtimelog.settings import Settings
-from gtimelog.timelog import TimeLog, parse_datetime
+from gtimelog.timelog import (
+    Reports,
+    TimeLog,
+    TimeWindow,
+    parse_datetime,
+)
 
 
 fns = []
+memory_fns = []
+report_fns = []
 
 
 def mark(fn):
@@ -22,6 +33,16 @@ def mark(fn):
     return fn
 
 
+def mark_memory(fn):
+    memory_fns.append(fn)
+    return fn
+
+
+def mark_report(fn):
+    report_fns.append(fn)
+    return fn
+
+
 def unmark(fn):
     return fn
 
@@ -52,6 +73,17 @@ def benchmark(fn, correct_output):
     print("\rmin {:.3f}s avg {:.3f}s (n={})\n".format(m, tot / n, n))
 
 
+def benchmark_memory(fn):
+    gc.collect()
+    tracemalloc.start()
+    output = fn()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del output
+    print("{}: {:.1f} MiB (peak {:.1f} MiB)\n".format(
+        fn.__name__, size / 2**20, peak / 2**20))
+
+
 @unmark
 def just_read():
     filename = Settings().get_timelog_file()
@@ -225,15 +257,86 @@ def parse_and_sort_python3():
     return items
 
 
+@mark
+def parse_bulk():
+    filename = Settings().get_timelog_file()
+    text = open(filename, 'r', encoding='UTF-8').read()
+    return TimeLog._read_text(text)
+
+
 @mark
 def full():
     return TimeLog(Settings().get_timelog_file(), Settings().virtual_midnight).items
 
 
+@mark
+def full_compact():
+    return TimeLog(Settings().get_timelog_file(), Settings().virtual_midnight,
+                   compact=True).items
+
+
+@mark
+def full_mapped():
+    return TimeLog(Settings().get_timelog_file(), Settings().virtual_midnight,
+                   use_mmap=True).items
+
+
+@functools.lru_cache()
+def many_tags_timelog():
+    # a month of entries every 15 minutes, with 3 out of 200 tags each
+    lines = []
+    n = 0
+    for day in range(1, 32):
+        start = datetime.datetime(2024, 1, day, 9, 0)
+        lines.append('{:%Y-%m-%d %H:%M}: arrived'.format(start))
+        for i in range(1, 37):
+            tags = ' '.join('tag{:03}'.format((n + k * 67) % 200)
+                            for k in range(3))
+            lines.append('{:%Y-%m-%d %H:%M}: project{}: task{} -- {}'.format(
+                start + datetime.timedelta(minutes=15 * i), n % 20, n % 50,
+                tags))
+            n += 1
+        lines.append('')
+    return TimeLog(StringIO('\n'.join(lines)), datetime.time(2, 0))
+
+
+@mark_report
+def monthly_report_many_tags():
+    timelog = many_tags_timelog()
+    output = StringIO()
+    for style in ['plain', 'categorized']:
+        window = TimeWindow(timelog, datetime.datetime(2024, 1, 1, 2, 0),
+                            datetime.datetime(2024, 2, 1, 2, 0))
+        Reports(window, style=style).monthly_report(output, 'me@example.com',
+                                                    'Me')
+    return output.getvalue()
+
+
+@mark_memory
+def memory_items():
+    return TimeLog(Settings().get_timelog_file(), Settings().virtual_midnight)
+
+
+@mark_memory
+def memory_compact_items():
+    return TimeLog(Settings().get_timelog_file(), Settings().virtual_midnight,
+                   compact=True)
+
+
+@mark_memory
+def memory_mapped_items():
+    return TimeLog(Settings().get_timelog_file(), Settings().virtual_midnight,
+                   use_mmap=True)
+
+
 def main():
     correct = full()
     for fn in fns:
         benchmark(fn, correct)
+    for fn in memory_fns:
+        benchmark_memory(fn)
+    for fn in report_fns:
+        benchmark(fn, fn())
 
 
 if __name__ == '__main__':
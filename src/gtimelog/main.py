@@ -36,6 +36,7 @@ import os
 import re
 import signal
 import smtplib
+import threading
 from contextlib import closing
 from email.utils import formataddr, parseaddr
 from gettext import gettext as _
@@ -84,13 +85,15 @@ from gtimelog.settings import Settings
 from gtimelog.timelog import (
     ReportRecord,
     Reports,
+    ShardedTimeLog,
     TaskList,
     TimeLog,
     as_minutes,
-    different_days,
     next_month,
     parse_time,
     prev_month,
+    shard_filename,
+    split_timelog,
     uniq,
     virtual_day,
 )
@@ -171,6 +174,35 @@ def make_option(long_name, short_name=None, flags=0, arg=GLib.OptionArg.NONE,
     return option
 
 
+class ReloadScheduler(object):
+    """Coalesce file change notifications into a single reload.
+
+    Editors often save files in several steps, and we get a notification
+    for each one.  Every notification (re)starts a timer, and the callback
+    gets called once, after things quieten down.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.source_id = None
+        # How many 'events' we've seen, how many of them were 'coalesced'
+        # with a later one, and how many 'reloads' were done.
+        self.stats = collections.Counter()
+
+    def schedule(self, delay_ms):
+        self.stats['events'] += 1
+        if self.source_id is not None:
+            GLib.source_remove(self.source_id)
+            self.stats['coalesced'] += 1
+        self.source_id = GLib.timeout_add(delay_ms, self._timeout)
+
+    def _timeout(self):
+        self.source_id = None
+        self.stats['reloads'] += 1
+        self.callback()
+        return False
+
+
 soup_session = Soup.Session()
 authenticator = Authenticator()
 
@@ -210,6 +242,7 @@ class Application(Gtk.Application):
             make_option("--debug", description=_("Show debug information on the console")),
             make_option("--prefs", description=_("Open the preferences dialog")),
             make_option("--email-prefs", description=_("Open the preferences dialog on the email page")),
+            make_option("--split-timelog", description=_("Split timelog.txt into one file per year and exit")),
         ])
 
     def check_schema(self):
@@ -242,6 +275,18 @@ class Application(Gtk.Application):
             else:
                 print(_('Settings already migrated to GSettings (org.gtimelog)'))
             return 0
+        if options.contains('split-timelog'):
+            settings = Settings()
+            try:
+                created = split_timelog(settings.get_timelog_file(),
+                                        settings.get_timelog_shard_dir())
+            except (IOError, OSError) as e:
+                print(_('Could not split the time log: {}').format(e), file=sys.stderr)
+                return 1
+            for filename in created:
+                print(_('Created {}').format(filename))
+            print(_('{} will no longer be used; you may remove it').format(settings.get_timelog_file()))
+            return 0
         return -1  # send the args to the remote instance for processing
 
     def do_command_line(self, command_line):
@@ -318,7 +363,12 @@ class Application(Gtk.Application):
             Gtk.show_uri(None, uri, Gdk.CURRENT_TIME)
 
     def on_edit_log(self, action, parameter):
-        filename = Settings().get_timelog_file()
+        settings = Settings()
+        shard_dir = settings.get_timelog_shard_dir()
+        if os.path.isdir(shard_dir):
+            filename = shard_filename(shard_dir, datetime.date.today().year)
+        else:
+            filename = settings.get_timelog_file()
         self.open_in_editor(filename)
 
     def on_edit_tasks(self, action, parameter):
@@ -522,6 +572,8 @@ class Window(Gtk.ApplicationWindow):
         Gtk.ApplicationWindow.__init__(self, application=app, icon_name='gtimelog')
 
         self._watches = {}
+        self._timelog_reloader = ReloadScheduler(self.check_reload)
+        self._tasks_reloader = ReloadScheduler(self.check_reload_tasks)
         self._download = None
         self._date = None
         self._showing_today = None
@@ -529,6 +581,8 @@ class Window(Gtk.ApplicationWindow):
         self.editing_remote_tasks = False
         self.timelog = None
         self.tasks = None
+        self.pending_entries = []
+        self.load_error = None
         self.app = app
 
         mark_time("loading ui")
@@ -705,13 +759,90 @@ class Window(Gtk.ApplicationWindow):
 
     def load_log(self):
         mark_time("loading timelog")
-        timelog = TimeLog(Settings().get_timelog_file(), self.get_virtual_midnight())
-        mark_time("timelog loaded")
+        settings = Settings()
+        # Parsing a large timelog.txt takes a while, so do it in a
+        # background thread and keep the UI responsive meanwhile.
+        thread = threading.Thread(
+            target=self._load_log_in_thread,
+            args=(settings.get_timelog_file(), self.get_virtual_midnight(),
+                  settings.get_timelog_cache_file(),
+                  settings.get_timelog_shard_dir()),
+            name='gtimelog-loader', daemon=True)
+        thread.start()
+
+    def _load_log_in_thread(self, filename, virtual_midnight, cache_filename,
+                            shard_dir):
+        # This must not touch any GTK widgets!
+        if os.path.isdir(shard_dir):
+            # Older years are loaded when needed
+            try:
+                timelog = ShardedTimeLog(shard_dir, virtual_midnight,
+                                         compact=True)
+            except Exception:
+                log.exception("Failed to load %s", shard_dir)
+                GLib.idle_add(self.log_load_failed, shard_dir)
+                return
+            GLib.idle_add(self.log_loaded, timelog)
+            return
+        # Load this week first, so the user can start working right away,
+        # then load the rest of the history and swap it in.
+        today = virtual_day(datetime.datetime.now(), virtual_midnight)
+        monday = today - datetime.timedelta(today.weekday())
+        since = datetime.datetime.combine(monday, virtual_midnight)
+        try:
+            timelog = TimeLog(filename, virtual_midnight, compact=True,
+                              since=since)
+            if not timelog.complete:
+                GLib.idle_add(self.log_loaded, timelog)
+                mark_time("loading the rest of timelog")
+                timelog = TimeLog(filename, virtual_midnight,
+                                  cache_filename=cache_filename, compact=True)
+        except Exception:
+            log.exception("Failed to load %s", filename)
+            GLib.idle_add(self.log_load_failed, filename)
+            return
+        GLib.idle_add(self.log_loaded, timelog)
+
+    def log_load_failed(self, filename):
+        if self.timelog is not None:
+            # we can keep working with the part of the history that was
+            # loaded already
+            return False
+        # entries typed from now on couldn't be saved, so stop taking them
+        self.load_error = _("Could not load {0}").format(filename)
+        self.enable_add_entry()
+        self.log_view.populate_log()
+        return False
+
+    def log_loaded(self, timelog):
+        mark_time("timelog loaded" if timelog.complete else
+                  "part of timelog loaded")
+        if self.timelog is not None:
+            # This is the full history replacing a partially loaded time
+            # log; catch up with any entries added in the meantime.
+            timelog.check_reload()
+            if self.timelog.virtual_midnight != timelog.virtual_midnight:
+                timelog.virtual_midnight = self.timelog.virtual_midnight
+            self.timelog.close()
+            self.timelog = timelog
+            self.tick(True)
+            mark_time("full timelog presented")
+            return False
+        pending, self.pending_entries = self.pending_entries, []
+        entries = []
+        for entry, now in pending:
+            entry, correction = timelog.parse_correction(entry)
+            if entry:
+                entries.append((correction or now, entry))
+        timelog.append_many(entries)
+        if pending:
+            mark_time("queued entries appended")
         self.timelog = timelog
         self.tick(True)
         self.enable_add_entry()
         mark_time("timelog presented")
         self.watch_file(self.timelog.filename, self.on_timelog_file_changed)
+        return False
 
     def load_tasks(self, *args):
         mark_time("loading tasks")
@@ -829,8 +960,7 @@ class Window(Gtk.ApplicationWindow):
 
     def virtual_midnight_changed(self, *args):
         if self.timelog:
-            # This is only partially correct: we're not reloading old logs.
-            # (Reloading old logs would also be partially incorrect.)
+            # This also recomputes today's window and the index of days.
             self.timelog.virtual_midnight = self.get_virtual_midnight()
 
     def delay_store_window_size(self, *args):
@@ -1025,6 +1155,16 @@ class Window(Gtk.ApplicationWindow):
         mark_time()
         mark_time("on_add_entry")
         entry = self.get_current_task()
+        if self.timelog is None:
+            if self.load_error is not None:
+                return
+            # still loading; we'll add it when we're done
+            now = datetime.datetime.now().replace(second=0, microsecond=0)
+            self.pending_entries.append((entry, now))
+            self.task_entry.set_text('')
+            self.task_entry.grab_focus()
+            self.log_view.populate_log()
+            return
         entry, now = self.timelog.parse_correction(entry)
         if not entry:
             return
@@ -1167,34 +1307,39 @@ class Window(Gtk.ApplicationWindow):
         # - Gio.FileMonitorEvent.CHANGED
         # - Gio.FileMonitorEvent.CHANGES_DONE_HINT
         # - Gio.FileMonitorEvent.ATTRIBUTE_CHANGED
-        # So, plan: react to CHANGES_DONE_HINT at once, but in case some
+        # So, plan: react to CHANGES_DONE_HINT soon, but in case some
         # systems/OSes don't ever send it, react to other events after a
-        # short delay, so we wouldn't have to reload the file more than
-        # once.
+        # longer delay.  Any further events postpone the reload, so we
+        # wouldn't have to reload the file more than once.
         log.debug('watch on %s reports %s', file.get_path(), event_type.value_nick.upper())
-        if event_type == Gio.FileMonitorEvent.CHANGES_DONE_HINT:
-            self.check_reload()
-        else:
-            GLib.timeout_add_seconds(1, self.check_reload)
+        self._timelog_reloader.schedule(self._reload_delay(event_type))
 
     def on_tasks_file_changed(self, monitor, file, other_file, event_type):
         log.debug('watch on %s reports %s', file.get_path(), event_type.value_nick.upper())
+        self._tasks_reloader.schedule(self._reload_delay(event_type))
+
+    def _reload_delay(self, event_type):
         if event_type == Gio.FileMonitorEvent.CHANGES_DONE_HINT:
-            self.check_reload_tasks()
+            return 100
         else:
-            GLib.timeout_add_seconds(1, self.check_reload_tasks)
+            return 1000
 
     def check_reload(self):
         if self.timelog and self.timelog.check_reload():
             self.notify('timelog')
             self.tick(True)
+        if self.timelog:
+            log.debug('reload stats: %s, %s',
+                      dict(self._timelog_reloader.stats),
+                      dict(self.timelog.reload_stats))
 
     def check_reload_tasks(self):
         if self.tasks and self.tasks.check_reload():
             self.notify('tasks')
 
     def enable_add_entry(self):
-        enabled = self.timelog is not None and self.get_current_task()
+        # entries added while the time log is loading are queued
+        enabled = bool(self.get_current_task()) and self.load_error is None
         self.actions.add_entry.set_enabled(enabled)
 
     def task_entry_changed(self, widget):
@@ -1499,13 +1644,26 @@ class LogView(Gtk.TextView):
         self._update_pending = False
         self.get_buffer().set_text('')
         if self.timelog is None:
-            return # not loaded yet
+            # not loaded yet
+            window = self.get_toplevel()
+            pending = getattr(window, 'pending_entries', ())
+            load_error = getattr(window, 'load_error', None)
+            if load_error is None:
+                self.w(_("Loading..."))
+            else:
+                self.w(load_error)
+                if pending:
+                    self.w("\n\n")
+                    self.w(_("These entries were not saved:"))
+            for entry, now in pending:
+                self.w("\n{0:%H:%M}: {1}".format(now, entry))
+            return
         window = self.get_time_window()
         total = datetime.timedelta(0)
         if self.detail_level == 'chronological':
             prev = None
-            for item in window.all_entries():
-                first_of_day = prev is None or different_days(prev, item.start, self.timelog.virtual_midnight)
+            for item, day in zip(window.all_entries(), window.day_ordinals()):
+                first_of_day = day != prev
                 if first_of_day and prev is not None:
                     self.w("\n")
                 if self.time_range != 'day' and first_of_day:
@@ -1513,7 +1671,7 @@ class LogView(Gtk.TextView):
                 if self.filter_text in item.entry:
                     self.write_item(item)
                     total += item.duration
-                prev = item.start
+                prev = day
         elif self.detail_level == 'grouped':
             work, slack = window.grouped_entries(sorted_by=self.log_order,
                                                  sorted_tasks=self.tasks)
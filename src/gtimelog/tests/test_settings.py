@@ -104,6 +104,16 @@ class TestSettings(unittest.TestCase):
         self.assertEqual(self.settings.get_timelog_file(),
                          os.path.normpath('~/.local/share/gtimelog/timelog.txt'))
 
+    def test_get_timelog_shard_dir(self):
+        self.settings.get_data_dir = lambda: os.path.normpath('~/.local/share/gtimelog')
+        self.assertEqual(self.settings.get_timelog_shard_dir(),
+                         os.path.normpath('~/.local/share/gtimelog/timelog.d'))
+
+    def test_get_timelog_cache_file(self):
+        self.settings.get_data_dir = lambda: os.path.normpath('~/.local/share/gtimelog')
+        self.assertEqual(self.settings.get_timelog_cache_file(),
+                         os.path.normpath('~/.local/share/gtimelog/timelog.cache'))
+
     def test_get_report_log_file(self):
         self.settings.get_data_dir = lambda: os.path.normpath('~/.local/share/gtimelog')
         self.assertEqual(self.settings.get_report_log_file(),
@@ -1,8 +1,10 @@
 """Tests for gtimelog.timelog"""
 
+import concurrent.futures
 import datetime
 import doctest
 import os
+import random
 import re
 import shutil
 import sys
@@ -16,12 +18,20 @@ from unittest import mock
 import freezegun
 
 from gtimelog.timelog import (
+    Aggregates,
+    CompactItems,
     Exports,
+    ItemSlice,
     ReportRecord,
     Reports,
+    ShardedTimeLog,
+    StreamedWindow,
     TaskList,
     TimeCollection,
     TimeLog,
+    fsync_dir,
+    split_timelog,
+    write_reports,
 )
 
 
@@ -128,6 +138,30 @@ def doctest_parse_datetime():
     """
 
 
+def doctest_datetime_to_minutes():
+    """Tests for datetime_to_minutes
+
+        >>> from gtimelog.timelog import datetime_to_minutes
+        >>> from gtimelog.timelog import minutes_to_datetime
+        >>> from gtimelog.timelog import minutes_to_datetimes
+        >>> from datetime import datetime
+        >>> datetime_to_minutes(datetime(1, 1, 1))
+        0
+        >>> datetime_to_minutes(datetime(1, 1, 2, 1, 30))
+        1530
+        >>> minutes_to_datetime(1530)
+        datetime.datetime(1, 1, 2, 1, 30)
+        >>> m = datetime_to_minutes(datetime(2013, 12, 4, 9, 14))
+        >>> minutes_to_datetime(m)
+        datetime.datetime(2013, 12, 4, 9, 14)
+        >>> list(minutes_to_datetimes([m, m + 1, m + 24 * 60]))
+        [datetime.datetime(2013, 12, 4, 9, 14),
+         datetime.datetime(2013, 12, 4, 9, 15),
+         datetime.datetime(2013, 12, 5, 9, 14)]
+
+    """
+
+
 def doctest_parse_time():
     """Tests for parse_time
 
@@ -314,6 +348,21 @@ def doctest_uniq():
     """
 
 
+def doctest_get_mtime():
+    """Tests for get_mtime and get_mtime_and_size
+
+        >>> from gtimelog.timelog import get_mtime, get_mtime_and_size
+        >>> get_mtime('/no/such/file'), get_mtime_and_size('/no/such/file')
+        (None, (None, None))
+
+    File-like objects are accepted, for the benefit of unit tests.
+
+        >>> get_mtime(StringIO()), get_mtime_and_size(StringIO())
+        (None, (None, None))
+
+    """
+
+
 def make_time_window(file=None, min=None, max=None, vm=datetime.time(2)):
     if file is None:
         file = StringIO()
@@ -1023,6 +1072,31 @@ class TestTimeCollection(Mixins, unittest.TestCase):
         self.assertEqual(sp('project: '), ('project', ''))
         self.assertEqual(sp('project:'), ('project', ''))
 
+    def test_items_between(self):
+        tc = TimeCollection(datetime.time(2, 0))
+        tc.items = [
+            (datetime.datetime(2018, 12, 9, 8, 30), 'start'),
+            (datetime.datetime(2018, 12, 9, 8, 40), 'emails'),
+            (datetime.datetime(2018, 12, 9, 9, 0), 'coding'),
+        ]
+        self.assertEqual(
+            tc.items_between(datetime.datetime(2018, 12, 9, 8, 40),
+                             datetime.datetime(2018, 12, 9, 9, 0)),
+            [(datetime.datetime(2018, 12, 9, 8, 40), 'emails')])
+
+    def test_items_changed_in_place(self):
+        tc = TimeCollection(datetime.time(2, 0))
+        tc.items = [
+            (datetime.datetime(2018, 12, 9, 8, 30), 'start'),
+            (datetime.datetime(2018, 12, 9, 8, 40), 'emails'),
+        ]
+        self.assertEqual(tc.totals()[0], datetime.timedelta(minutes=10))
+        self.assertEqual(len(list(tc.all_entries())), 2)
+        tc.items.append((datetime.datetime(2018, 12, 9, 9, 0), 'coding'))
+        self.assertEqual(len(list(tc.all_entries())), 3)
+        self.assertEqual(tc.totals()[0], datetime.timedelta(minutes=30))
+        self.assertEqual(tc.last_entry().entry, 'coding')
+
     def test_sorted_grouped_time_collection(self):
         # the unsorted list is nromally a TimeCollection but we fake it
         unsorted_list = (  # list of (start-time, name, duration)
@@ -1059,6 +1133,138 @@ class TestTimeCollection(Mixins, unittest.TestCase):
         self.assertEqual(tc_sorted('task-list'), sorted_by['task-list'])
 
 
+class TestItemSlice(unittest.TestCase):
+
+    def setUp(self):
+        self.items = [(n, str(n)) for n in range(10)]
+        self.timestamps = list(range(10))
+        self.view = ItemSlice(self.items, self.timestamps, 2, 6)
+
+    def test_sequence(self):
+        self.assertEqual(len(self.view), 4)
+        self.assertEqual(list(self.view), self.items[2:6])
+        self.assertEqual(self.view[0], (2, '2'))
+        self.assertEqual(self.view[-1], (5, '5'))
+        with self.assertRaises(IndexError):
+            self.view[4]
+        with self.assertRaises(IndexError):
+            self.view[-5]
+
+    def test_slicing(self):
+        self.assertIsInstance(self.view[1:], ItemSlice)
+        self.assertEqual(self.view[1:], self.items[3:6])
+        self.assertEqual(self.view[-2:], self.items[4:6])
+        self.assertEqual(self.view[3:1], [])
+        self.assertEqual(self.view[::2], self.items[2:6:2])
+
+    def test_comparison(self):
+        self.assertEqual(self.view, self.items[2:6])
+        self.assertEqual(self.view, ItemSlice(list(self.items), self.timestamps, 2, 6))
+        self.assertNotEqual(self.view, self.items)
+        self.assertNotEqual(self.view, tuple(self.items[2:6]))
+        self.assertEqual(repr(self.view), repr(self.items[2:6]))
+
+    def test_growing_underlying_list(self):
+        view = ItemSlice(self.items, self.timestamps)
+        self.items.append((10, '10'))
+        self.assertEqual(len(view), 10)
+
+    def test_between(self):
+        self.assertEqual(self.view.between(0, 4), self.items[2:4])
+        self.assertEqual(self.view.between(3, 100), self.items[3:6])
+        self.assertEqual(self.view.between(4, 3), [])
+
+
+class TestCompactItems(unittest.TestCase):
+
+    def setUp(self):
+        self.list = [
+            (datetime.datetime(2018, 12, 9, 8, 30), 'start **'),
+            (datetime.datetime(2018, 12, 9, 8, 40), 'emails'),
+            (datetime.datetime(2018, 12, 9, 9, 0), 'coding'),
+            (datetime.datetime(2018, 12, 10, 9, 0), 'start **'),
+            (datetime.datetime(2018, 12, 10, 9, 20), 'emails'),
+        ]
+        self.items = CompactItems(self.list)
+
+    def test_sequence(self):
+        self.assertEqual(len(self.items), 5)
+        self.assertEqual(list(self.items), self.list)
+        self.assertEqual(self.items[1], self.list[1])
+        self.assertEqual(self.items[-1], self.list[-1])
+        self.assertEqual(self.items[1:3], self.list[1:3])
+        self.assertEqual(self.items[::-2], self.list[::-2])
+        with self.assertRaises(IndexError):
+            self.items[5]
+
+    def test_strings_are_shared(self):
+        self.assertEqual(self.items.strings, ['start **', 'emails', 'coding'])
+        self.assertIs(self.items[0][1], self.items[3][1])
+
+    def test_comparison(self):
+        self.assertEqual(self.items, self.list)
+        self.assertEqual(self.list, self.items)
+        self.assertEqual(self.items, CompactItems(self.list))
+        self.assertEqual(self.items, ItemSlice(self.list, []))
+        self.assertNotEqual(self.items, self.list[:-1])
+        self.assertNotEqual(self.items, tuple(self.list))
+        self.assertEqual(repr(self.items), repr(self.list))
+
+    def test_modification(self):
+        item = (datetime.datetime(2018, 12, 9, 8, 35), 'coffee **')
+        self.items.insert(1, item)
+        self.list.insert(1, item)
+        self.assertEqual(self.items, self.list)
+        self.items.append(item)
+        self.list.append(item)
+        self.assertEqual(self.items, self.list)
+        self.items.extend(self.items)
+        self.list.extend(self.list)
+        self.assertEqual(self.items, self.list)
+        self.items[0] = self.list[0] = item
+        self.assertEqual(self.items, self.list)
+        del self.items[-1]
+        del self.list[-1]
+        self.assertEqual(self.items, self.list)
+        with self.assertRaises(TypeError):
+            self.items[:2] = []
+
+    def test_copy(self):
+        copy = self.items.copy()
+        copy.append((datetime.datetime(2018, 12, 10, 9, 30), 'new'))
+        self.assertEqual(self.items, self.list)
+        self.assertEqual(len(copy), 6)
+        self.assertNotIn('new', self.items.strings)
+
+    def test_from_buffer(self):
+        buffer = '2018-12-09 08:30: caf\N{LATIN SMALL LETTER E WITH ACUTE} \n'.encode()
+        items = CompactItems.from_buffer(buffer, [1, 2], [18, 24, 18, 24])
+        self.assertEqual(items.strings, [])
+        self.assertEqual(items[1], (datetime.datetime(1, 1, 1, 0, 2),
+                                    'caf\N{LATIN SMALL LETTER E WITH ACUTE}'))
+        self.assertEqual(len(items.strings), 1)
+        self.assertEqual(list(items), [
+            (datetime.datetime(1, 1, 1, 0, 1), 'caf\N{LATIN SMALL LETTER E WITH ACUTE}'),
+            (datetime.datetime(1, 1, 1, 0, 2), 'caf\N{LATIN SMALL LETTER E WITH ACUTE}'),
+        ])
+        self.assertEqual(len(items.strings), 1)
+        items.append((datetime.datetime(1, 1, 1, 0, 3), 'more'))
+        self.assertEqual(items.copy(), items)
+
+    def test_from_columns(self):
+        items = CompactItems.from_columns(self.items.minutes,
+                                          [entry for t, entry in self.list])
+        self.assertEqual(items, self.list)
+
+    def test_timestamps(self):
+        timestamps = self.items.timestamps
+        self.assertEqual(len(timestamps), 5)
+        self.assertEqual(timestamps[-1], datetime.datetime(2018, 12, 10, 9, 20))
+        self.assertEqual(timestamps[1:3], [t for t, entry in self.list[1:3]])
+        self.items.append((datetime.datetime(2018, 12, 10, 9, 30), 'new'))
+        self.assertEqual(timestamps[-1], datetime.datetime(2018, 12, 10, 9, 30))
+
+
 class TestTaskList(Mixins, unittest.TestCase):
 
     def test_missing_file(self):
@@ -1134,12 +1340,507 @@ class TestTimeLog(Mixins, unittest.TestCase):
         self.assertTrue(timelog.check_reload())
         self.assertFalse(timelog.check_reload())
 
+    def test_reloading_notices_size_changes(self):
+        logfile = self.write_file('timelog.txt', '2018-12-09 08:30: start **\n')
+        timelog = TimeLog(logfile, datetime.time(2, 0))
+        st = os.stat(logfile)
+        with open(logfile, 'a') as f:
+            f.write('2018-12-09 09:00: work\n')
+        # some file systems have coarse timestamps
+        os.utime(logfile, (st.st_atime, st.st_mtime))
+        self.assertTrue(timelog.check_reload())
+        self.assertEqual(len(timelog.items), 2)
+
+    def test_reload_stats(self):
+        logfile = self.write_file('timelog.txt', '2018-12-09 08:30: start **\n')
+        timelog = TimeLog(logfile, datetime.time(2, 0))
+        self.assertFalse(timelog.check_reload())
+        self.assertFalse(timelog.check_reload())
+        timelog.append('work', now=datetime.datetime(2018, 12, 9, 9, 0))
+        self.assertFalse(timelog.check_reload())
+        with open(logfile, 'a') as f:
+            f.write('2018-12-09 10:00: more work\n')
+        self.assertTrue(timelog.check_reload())
+        with open(logfile, 'w') as f:
+            f.write('2018-12-09 10:00: all new\n')
+        self.assertTrue(timelog.check_reload())
+        self.assertEqual(timelog.reload_stats,
+                         dict(unchanged=4, appended=1, reread=1))
+
+    def test_append_many(self):
+        logfile = self.write_file('timelog.txt', '2018-12-09 08:30: start **\n')
+        timelog = TimeLog(logfile, datetime.time(2, 0))
+        self.addCleanup(timelog.close)
+        timelog.append_many([
+            (datetime.datetime(2018, 12, 9, 9, 0), 'work'),
+            (datetime.datetime(2018, 12, 10, 8, 30), 'start **'),
+            (datetime.datetime(2018, 12, 10, 8, 15), 'coffee **'),
+        ])
+        timelog.append_many([])
+        with open(logfile) as f:
+            self.assertEqual(f.read(), textwrap.dedent('''\
+                2018-12-09 08:30: start **
+                2018-12-09 09:00: work
+
+                2018-12-10 08:30: start **
+                2018-12-10 08:15: coffee **
+            '''))
+        self.assertEqual(timelog.items,
+                         TimeLog(logfile, datetime.time(2, 0)).items)
+        self.assertFalse(timelog.check_reload())
+
+    def test_append_keeps_the_file_open(self):
+        logfile = self.tempfile()
+        timelog = TimeLog(logfile, datetime.time(2, 0))
+        self.addCleanup(timelog.close)
+        timelog.append('start **', now=datetime.datetime(2018, 12, 9, 8, 30))
+        f = timelog._append_file
+        timelog.append('work', now=datetime.datetime(2018, 12, 9, 9, 0))
+        self.assertIs(timelog._append_file, f)
+        self.assertFalse(f.closed)
+        # a file that was replaced with a new one is reopened
+        os.unlink(logfile)
+        with open(logfile, 'w') as f2:
+            f2.write('2018-12-09 08:30: start **\n')
+        timelog.append('more work', now=datetime.datetime(2018, 12, 9, 10, 0))
+        self.assertTrue(f.closed)
+        with open(logfile) as f2:
+            self.assertEqual(f2.read(), textwrap.dedent('''\
+                2018-12-09 08:30: start **
+                2018-12-09 10:00: more work
+            '''))
+        timelog.close()
+        self.assertIsNone(timelog._append_file)
+        timelog.close()
+
+    def test_append_notices_the_file_was_replaced(self):
+        logfile = self.write_file('timelog.txt', '2018-12-09 08:30: start **\n')
+        timelog = TimeLog(logfile, datetime.time(2, 0))
+        self.addCleanup(timelog.close)
+        timelog.append('work', now=datetime.datetime(2018, 12, 9, 9, 0))
+        newfile = self.write_file('new.txt', '2018-12-09 08:30: start **\n')
+        os.replace(newfile, logfile)
+        timelog.append('more work', now=datetime.datetime(2018, 12, 9, 10, 0))
+        with open(logfile) as f:
+            self.assertEqual(f.read(), textwrap.dedent('''\
+                2018-12-09 08:30: start **
+                2018-12-09 10:00: more work
+            '''))
+        self.assertEqual(timelog.reload_stats, dict(unchanged=1, reread=1))
+
+    def test_append_notices_the_file_was_removed(self):
+        logfile = self.write_file('timelog.txt', '2018-12-09 08:30: start **\n')
+        timelog = TimeLog(logfile, datetime.time(2, 0))
+        self.addCleanup(timelog.close)
+        timelog.append('work', now=datetime.datetime(2018, 12, 9, 9, 0))
+        os.unlink(logfile)
+        timelog.append('more work', now=datetime.datetime(2018, 12, 9, 10, 0))
+        with open(logfile) as f:
+            self.assertEqual(f.read(), '2018-12-09 10:00: more work\n')
+        self.assertEqual(timelog.items,
+                         [(datetime.datetime(2018, 12, 9, 10, 0), 'more work')])
+
+    def test_append_checks_the_open_file(self):
+        logfile = self.write_file('timelog.txt', '2018-12-09 08:30: start **\n')
+        timelog = TimeLog(logfile, datetime.time(2, 0))
+        self.addCleanup(timelog.close)
+        timelog.append('work', now=datetime.datetime(2018, 12, 9, 9, 0))
+        with mock.patch('os.stat', wraps=os.stat) as stat:
+            timelog.append('more work',
+                           now=datetime.datetime(2018, 12, 9, 10, 0))
+        self.assertEqual(stat.call_count, 1)
+        with open(logfile, 'a') as f:
+            f.write('2018-12-09 10:30: coffee **\n')
+        timelog.append('lunch **', now=datetime.datetime(2018, 12, 9, 12, 0))
+        self.assertEqual(timelog.items,
+                         TimeLog(logfile, datetime.time(2, 0)).items)
+        self.assertEqual(timelog.items[-2][1], 'coffee **')
+        self.assertEqual(timelog.reload_stats,
+                         dict(unchanged=2, appended=1))
+
+    def test_raw_append(self):
+        logfile = self.write_file('timelog.txt', '2018-12-09 08:30: start **\n')
+        timelog = TimeLog(logfile, datetime.time(2, 0))
+        self.addCleanup(timelog.close)
+        timelog.raw_append('# a comment', need_space=True)
+        with open(logfile) as f:
+            self.assertEqual(f.read(),
+                             '2018-12-09 08:30: start **\n\n# a comment\n')
+        self.assertFalse(timelog.check_reload())
+
+    def test_append_fsync(self):
+        logfile = self.tempfile()
+        entries = [(datetime.datetime(2018, 12, 9, 8, 30), 'start **'),
+                   (datetime.datetime(2018, 12, 9, 9, 0), 'work')]
+        for policy, expected in [(TimeLog.FSYNC_NEVER, 0),
+                                 (TimeLog.FSYNC_ENTRY, 2),
+                                 (TimeLog.FSYNC_BATCH, 1)]:
+            timelog = TimeLog(logfile, datetime.time(2, 0), fsync=policy)
+            with mock.patch('os.fsync') as fsync:
+                timelog.append_many(entries)
+            timelog.close()
+            self.assertEqual(fsync.call_count, expected, policy)
+
+    def test_parsing(self):
+        logfile = self.write_file('timelog.txt', textwrap.dedent('''\
+            2018-12-09 08:30: start **
+            2018-02-30 08:40: bad date
+            2018-12-09 24:00: bad hour
+            2018-12-09 08:60: bad minute
+            2018-12-09 +8:45: lenient
+            2018-13-09 +8:45: lenient, but bad date
+            2018-12-09 08:50:no space
+            not an entry
+
+            2018-12-09 08:55:   spaces\t
+            2018-12-09 09:00: emails: again
+            2018-12-09 08:35: out of order
+        '''))
+        expected = [
+            (datetime.datetime(2018, 12, 9, 8, 30), 'start **'),
+            (datetime.datetime(2018, 12, 9, 8, 35), 'out of order'),
+            (datetime.datetime(2018, 12, 9, 8, 45), 'lenient'),
+            (datetime.datetime(2018, 12, 9, 8, 55), 'spaces'),
+            (datetime.datetime(2018, 12, 9, 9, 0), 'emails: again'),
+        ]
+        timelog = TimeLog(logfile, datetime.time(2, 0))
+        self.assertEqual(timelog.items, expected)
+        timelog = TimeLog(logfile, datetime.time(2, 0), use_mmap=True)
+        self.assertEqual(timelog.items, expected)
+        timelog = TimeLog(logfile, datetime.time(2, 0), compact=True)
+        self.assertEqual(timelog.items, expected)
+
+    def test_assigning_items(self):
+        items = [(datetime.datetime(2024, 1, 1, 9, 0), 'a'),
+                 (datetime.datetime(2024, 1, 1, 10, 0), 'b')]
+        for compact in (False, True):
+            timelog = TimeLog(StringIO(), datetime.time(2, 0), compact=compact)
+            timelog.items = items
+            self.assertEqual(
+                list(timelog.window_for_day(datetime.date(2024, 1, 1)).items),
+                items)
+
+    def test_parsing_bad_well_formed_timestamps(self):
+        logfile = self.write_file('timelog.txt', textwrap.dedent('''\
+            2018-12-09 08:30: start **
+            2018-02-30 08:40: bad date
+            2018-12-09 24:00: bad hour
+            2018-12-09 08:35: out of order
+        '''))
+        self.assertEqual(TimeLog(logfile, datetime.time(2, 0)).items, [
+            (datetime.datetime(2018, 12, 9, 8, 30), 'start **'),
+            (datetime.datetime(2018, 12, 9, 8, 35), 'out of order'),
+        ])
+
+    def touch(self, filename):
+        # make sure the mtime changes even on filesystems with coarse
+        # timestamps
+        st = os.stat(filename)
+        os.utime(filename, (st.st_atime, st.st_mtime + 1))
+
+    def test_reloading_parses_only_appended_lines(self):
+        logfile = self.write_file('timelog.txt', textwrap.dedent('''\
+            2018-12-09 08:30: start at home
+            2018-12-09 08:40: emails
+        '''))
+        timelog = TimeLog(logfile, datetime.time(2, 0))
+        with open(logfile, 'a') as f:
+            f.write('2018-12-09 12:15: coding\n')
+        self.touch(logfile)
+        with mock.patch.object(timelog, 'reread') as reread:
+            self.assertTrue(timelog.check_reload())
+        reread.assert_not_called()
+        self.assertEqual(timelog.items, [
+            (datetime.datetime(2018, 12, 9, 8, 30), 'start at home'),
+            (datetime.datetime(2018, 12, 9, 8, 40), 'emails'),
+            (datetime.datetime(2018, 12, 9, 12, 15), 'coding'),
+        ])
+
+    def test_reloading_appended_lines_out_of_order(self):
+        logfile = self.write_file('timelog.txt', textwrap.dedent('''\
+            2018-12-09 08:30: start at home
+            2018-12-09 08:40: emails
+        '''))
+        timelog = TimeLog(logfile, datetime.time(2, 0))
+        with open(logfile, 'a') as f:
+            f.write('2018-12-09 08:40: more emails\n')
+            f.write('2018-12-09 08:35: coffee **\n')
+        self.touch(logfile)
+        self.assertTrue(timelog.read_appended())
+        self.assertEqual(timelog.items, [
+            (datetime.datetime(2018, 12, 9, 8, 30), 'start at home'),
+            (datetime.datetime(2018, 12, 9, 8, 35), 'coffee **'),
+            (datetime.datetime(2018, 12, 9, 8, 40), 'emails'),
+            (datetime.datetime(2018, 12, 9, 8, 40), 'more emails'),
+        ])
+
+    def test_reloading_after_own_append(self):
+        logfile = self.tempfile()
+        timelog = TimeLog(logfile, datetime.time(2, 0))
+        timelog.append('start **', now=datetime.datetime(2018, 12, 9, 8, 30))
+        timelog.append('emails', now=datetime.datetime(2018, 12, 9, 8, 40))
+        with open(logfile, 'a') as f:
+            f.write('2018-12-09 12:15: coding\n')
+        self.touch(logfile)
+        self.assertTrue(timelog.read_appended())
+        self.assertEqual([entry for t, entry in timelog.items],
+                         ['start **', 'emails', 'coding'])
+
+    def test_reloading_modified_file(self):
+        logfile = self.write_file('timelog.txt', textwrap.dedent('''\
+            2018-12-09 08:30: start at home
+            2018-12-09 08:40: emails
+        '''))
+        timelog = TimeLog(logfile, datetime.time(2, 0))
+        self.write_file('timelog.txt', textwrap.dedent('''\
+            2018-12-09 08:30: start at work
+            2018-12-09 08:40: emails
+            2018-12-09 12:15: coding
+        '''))
+        self.touch(logfile)
+        self.assertFalse(timelog.read_appended())
+        self.assertTrue(timelog.check_reload())
+        self.assertEqual(timelog.items[0][1], 'start at work')
+        self.assertEqual(len(timelog.items), 3)
+
+    def test_reloading_same_size_edit_far_from_the_end(self):
+        lines = ['2018-12-09 09:15: entry %04d\n' % n for n in range(2000)]
+        logfile = self.write_file('timelog.txt', ''.join(lines))
+        timelog = TimeLog(logfile, datetime.time(2, 0))
+        lines[10] = '2018-12-09 09:45: entry 0010\n'
+        self.write_file('timelog.txt', ''.join(lines))
+        self.touch(logfile)
+        self.assertTrue(timelog.check_reload())
+        self.assertEqual(dict(timelog.reload_stats), {'reread': 1})
+        self.assertEqual(timelog.items[-1],
+                         (datetime.datetime(2018, 12, 9, 9, 45), 'entry 0010'))
+
+    def test_reloading_notices_changes_at_the_start(self):
+        lines = ['2018-12-09 09:15: entry %04d\n' % n for n in range(2000)]
+        logfile = self.write_file('timelog.txt', ''.join(lines))
+        timelog = TimeLog(logfile, datetime.time(2, 0))
+        lines[0] = '2018-12-09 09:15: entry zero\n'
+        lines.append('2018-12-09 10:00: more\n')
+        self.write_file('timelog.txt', ''.join(lines))
+        self.assertFalse(timelog.read_appended())
+        self.assertTrue(timelog.check_reload())
+        self.assertEqual(timelog.items[0][1], 'entry zero')
+
+    def test_reloading_notices_changes_at_the_end(self):
+        lines = ['2018-12-09 09:15: entry %04d\n' % n for n in range(2000)]
+        logfile = self.write_file('timelog.txt', ''.join(lines))
+        timelog = TimeLog(logfile, datetime.time(2, 0))
+        lines[-1] = '2018-12-09 09:15: last entry\n'
+        lines.append('2018-12-09 10:00: more\n')
+        self.write_file('timelog.txt', ''.join(lines))
+        self.assertFalse(timelog.read_appended())
+
+    def test_reloading_truncated_file(self):
+        logfile = self.write_file('timelog.txt', textwrap.dedent('''\
+            2018-12-09 08:30: start at home
+            2018-12-09 08:40: emails
+        '''))
+        timelog = TimeLog(logfile, datetime.time(2, 0))
+        self.write_file('timelog.txt', '2018-12-09 08:30: start at home\n')
+        self.touch(logfile)
+        self.assertFalse(timelog.read_appended())
+
+    def test_reloading_after_incomplete_last_line(self):
+        logfile = self.write_file('timelog.txt', textwrap.dedent('''\
+            2018-12-09 08:30: start at home
+            2018-12-09 08:40: ema'''))
+        timelog = TimeLog(logfile, datetime.time(2, 0))
+        self.assertEqual(timelog.items[-1][1], 'ema')
+        with open(logfile, 'a') as f:
+            f.write('ils\n')
+        self.touch(logfile)
+        self.assertFalse(timelog.read_appended())
+        self.assertTrue(timelog.check_reload())
+        self.assertEqual(timelog.items[-1][1], 'emails')
+
     def test_window_for_day(self):
         timelog = TimeLog(StringIO(), datetime.time(2, 0))
         window = timelog.window_for_day(datetime.date(2015, 9, 17))
         self.assertEqual(window.min_timestamp, datetime.datetime(2015, 9, 17, 2, 0))
         self.assertEqual(window.max_timestamp, datetime.datetime(2015, 9, 18, 2, 0))
 
+    def test_window_boundaries(self):
+        timelog = TimeLog(StringIO(textwrap.dedent('''\
+            2015-09-17 01:59: late night
+            2015-09-17 02:00: start **
+            2015-09-17 02:00: more start **
+            2015-09-17 12:00: work
+            2015-09-18 01:59: later night
+            2015-09-18 02:00: next day **
+        ''')), datetime.time(2, 0))
+        window = timelog.window_for_day(datetime.date(2015, 9, 17))
+        self.assertEqual([entry for t, entry in window.items],
+                         ['start **', 'more start **', 'work', 'later night'])
+        window = timelog.window_for_day(datetime.date(2015, 9, 19))
+        self.assertEqual(window.items, [])
+        window = timelog.window_for(datetime.datetime(2015, 9, 18),
+                                    datetime.datetime(2015, 9, 17))
+        self.assertEqual(window.items, [])
+
+    def test_day_index(self):
+        logfile = self.write_file('timelog.txt', textwrap.dedent('''\
+            2015-09-16 09:00: start **
+            2015-09-17 01:59: late night
+            2015-09-17 09:00: start **
+            2015-09-17 12:00: work
+            2015-09-20 09:00: start **
+        '''))
+        timelog = TimeLog(logfile, datetime.time(2, 0))
+        index = timelog.day_index()
+        self.assertEqual(list(index.days),
+                         [datetime.date(2015, 9, d).toordinal()
+                          for d in (16, 17, 20)])
+        self.assertEqual(list(index.starts), [0, 2, 4])
+        self.assertEqual(index.slice(datetime.date(2015, 9, 17),
+                                     datetime.date(2015, 9, 18)), (2, 4))
+        self.assertEqual(index.slice(datetime.date(2015, 9, 18),
+                                     datetime.date(2015, 9, 20)), (4, 4))
+        self.assertEqual(index.slice(datetime.date(2015, 9, 21),
+                                     datetime.date(2015, 9, 22)), (5, 5))
+        timelog.append('work', now=datetime.datetime(2015, 9, 20, 10, 0))
+        timelog.append('start **', now=datetime.datetime(2015, 9, 21, 9, 0))
+        self.assertIs(timelog.day_index(), index)
+        self.assertEqual(list(index.starts), [0, 2, 4, 6])
+        self.assertEqual(len(timelog.window_for_day(datetime.date(2015, 9, 20)).items), 2)
+
+    def test_day_ordinals(self):
+        logfile = self.write_file('timelog.txt', textwrap.dedent('''\
+            2015-09-16 09:00: start **
+            2015-09-17 01:59: late night
+            2015-09-17 09:00: start **
+            2015-09-20 09:00: start **
+        '''))
+        timelog = TimeLog(logfile, datetime.time(2, 0))
+        d16, d17, d20 = [datetime.date(2015, 9, d).toordinal()
+                         for d in (16, 17, 20)]
+        days = timelog.day_ordinals()
+        self.assertEqual(list(days), [d16, d16, d17, d20])
+        week = timelog.window_for_week(datetime.date(2015, 9, 17))
+        self.assertEqual(list(week.day_ordinals()), [d16, d16, d17, d20])
+        day = week.window_for(datetime.datetime(2015, 9, 17, 2, 0),
+                              datetime.datetime(2015, 9, 21, 2, 0))
+        self.assertEqual(list(day.day_ordinals()), [d17, d20])
+        day.virtual_midnight = datetime.time(0, 0)
+        self.assertEqual(list(day.day_ordinals()), [d17, d20])
+        timelog.append('work', now=datetime.datetime(2015, 9, 20, 10, 0))
+        self.assertIs(timelog.day_ordinals(), days)
+        self.assertEqual(list(days), [d16, d16, d17, d20, d20])
+
+    def test_day_index_honours_virtual_midnight(self):
+        timelog = TimeLog(StringIO(textwrap.dedent('''\
+            2015-09-16 09:00: start **
+            2015-09-17 01:59: late night
+            2015-09-17 09:00: start **
+        ''')), datetime.time(2, 0))
+        day = datetime.date(2015, 9, 16)
+        self.assertEqual(len(timelog.window_for_day(day).items), 2)
+        timelog.virtual_midnight = datetime.time(0, 0)
+        self.assertEqual(len(timelog.window_for_day(day).items), 1)
+        self.assertEqual(timelog.window.min_timestamp.time(),
+                         datetime.time(0, 0))
+
+    def test_day_rollup(self):
+        logfile = self.write_file('timelog.txt', textwrap.dedent('''\
+            2015-09-16 09:00: start **
+            2015-09-16 12:00: work -- tag
+            2015-09-17 01:59: late night
+            2015-09-17 09:00: start **
+            2015-09-17 12:00: work -- tag
+            2015-09-17 13:00: lunch ** -- tag
+            2015-09-17 13:30: misc ***
+            2015-09-20 09:00: coffee ***
+            2015-09-20 10:00: misc
+        '''))
+        timelog = TimeLog(logfile, datetime.time(2, 0))
+        rollup = timelog.day_rollup()
+        self.assertEqual(list(rollup.days),
+                         [datetime.date(2015, 9, d).toordinal()
+                          for d in (16, 17, 20)])
+        self.assertEqual([a.total_work for a in rollup.aggregates],
+                         [datetime.timedelta(hours=16, minutes=59),
+                          datetime.timedelta(hours=3),
+                          datetime.timedelta(hours=1)])
+        self.assertEqual(rollup.dates[0], {
+            datetime.date(2015, 9, 16): [datetime.timedelta(hours=9),
+                                         datetime.timedelta(0),
+                                         datetime.timedelta(hours=16,
+                                                            minutes=59)],
+        })
+        timelog.append('more misc', now=datetime.datetime(2015, 9, 20, 11, 0))
+        timelog.append('start **', now=datetime.datetime(2015, 9, 21, 9, 0))
+        self.assertIs(timelog.day_rollup(), rollup)
+        self.assertEqual(len(rollup.days), 4)
+        self.assertEqual(rollup.aggregates[2].total_work,
+                         datetime.timedelta(hours=2))
+        for first, last in [(16, 22), (17, 21), (18, 20), (17, 18)]:
+            min = datetime.datetime(2015, 9, first, 2, 0)
+            max = datetime.datetime(2015, 9, last, 2, 0)
+            window = timelog.window_for(min, max)
+            self.assertEqual(vars(rollup.aggregate(min.date(), max.date())),
+                             vars(Aggregates(window)))
+            self.assertEqual(rollup.daily_totals(min.date(), max.date()),
+                             window.daily_totals())
+
+    def test_long_windows_use_day_rollup(self):
+        timelog = TimeLog(StringIO(textwrap.dedent('''\
+            2015-09-16 09:00: start **
+            2015-09-16 12:00: work
+            2015-09-17 00:30: work
+            2015-09-17 01:30: more work
+            2015-09-17 09:00: start **
+            2015-09-17 12:00: work
+            2015-12-16 09:00: start **
+            2015-12-16 12:00: work
+        ''')), datetime.time(2, 0))
+        timelog.window_for_month(datetime.date(2015, 9, 1)).aggregate()
+        self.assertIsNone(timelog._day_rollup)
+        window = timelog.window_for_date_range(datetime.date(2015, 9, 1),
+                                               datetime.date(2015, 12, 31))
+        self.assertEqual(window.aggregate().total_work,
+                         datetime.timedelta(hours=22, minutes=30))
+        self.assertEqual(window.daily_totals(),
+                         TimeCollection.daily_totals(window))
+        self.assertEqual(len(window.daily_totals()), 3)
+        self.assertIsNotNone(timelog._day_rollup)
+        nested = window.window_for(window.min_timestamp, window.max_timestamp)
+        self.assertEqual(vars(nested.aggregate()), vars(window.aggregate()))
+        window = timelog.window_for(datetime.datetime(2015, 9, 1),
+                                    datetime.datetime(2016, 1, 1))
+        self.assertIsNone(timelog._rollup_for(window))
+        timelog.virtual_midnight = datetime.time(0, 0)
+        self.assertIsNone(timelog._day_rollup)
+
+    def test_nested_windows_share_items(self):
+        timelog = TimeLog(StringIO(textwrap.dedent('''\
+            2015-09-16 09:00: start **
+            2015-09-17 09:00: start **
+            2015-09-17 12:00: work
+            2015-09-18 09:00: start **
+        ''')), datetime.time(2, 0))
+        week = timelog.window_for_week(datetime.date(2015, 9, 17))
+        day = week.window_for(datetime.datetime(2015, 9, 17, 2, 0),
+                              datetime.datetime(2015, 9, 18, 2, 0))
+        self.assertEqual([entry for t, entry in day.items],
+                         ['start **', 'work'])
+        self.assertIs(day.items._items, timelog.items)
+
+    def test_windows_into_plain_lists(self):
+        window = TimeLog(StringIO(), datetime.time(2, 0)).window_for(
+            datetime.datetime(2015, 9, 17), datetime.datetime(2015, 9, 18))
+        window.items = [
+            (datetime.datetime(2015, 9, 17, 9, 0), 'start **'),
+            (datetime.datetime(2015, 9, 17, 12, 0), 'work'),
+        ]
+        nested = window.window_for(datetime.datetime(2015, 9, 17, 10, 0),
+                                   datetime.datetime(2015, 9, 17, 13, 0))
+        self.assertEqual(nested.items,
+                         [(datetime.datetime(2015, 9, 17, 12, 0), 'work')])
+
     def test_window_for_week(self):
         timelog = TimeLog(StringIO(), datetime.time(2, 0))
         for d in range(14, 21):
@@ -1182,6 +1883,199 @@ class TestTimeLog(Mixins, unittest.TestCase):
                               '\n',
                               '2014-11-13 08:00: new day **\n'])
 
+    def test_append_keeps_items_sorted(self):
+        timelog = TimeLog(self.tempfile(), datetime.time(2, 0))
+        timelog.append('start **', now=datetime.datetime(2014, 11, 12, 10, 0))
+        timelog.append('work', now=datetime.datetime(2014, 11, 12, 12, 0))
+        timelog.append('oops', now=datetime.datetime(2014, 11, 12, 11, 0))
+        timelog.append('start again **', now=datetime.datetime(2014, 11, 12, 10, 0))
+        self.assertEqual([entry for t, entry in timelog.items],
+                         ['start **', 'start again **', 'oops', 'work'])
+        window = timelog.window_for(datetime.datetime(2014, 11, 12, 11, 0),
+                                    datetime.datetime(2014, 11, 12, 12, 0))
+        self.assertEqual([entry for t, entry in window.items], ['oops'])
+
+    def test_append_updates_todays_window(self):
+        timelog = TimeLog(self.tempfile(), datetime.time(2, 0))
+        day = timelog.virtual_today()
+        timelog.append('start **', now=datetime.datetime.combine(day, datetime.time(9, 0)))
+        old_window = timelog.window_for_day(day)
+        timelog.append('work', now=datetime.datetime.combine(day, datetime.time(10, 0)))
+        self.assertEqual([entry for t, entry in timelog.window.items],
+                         ['start **', 'work'])
+        # existing windows are unaffected
+        self.assertEqual([entry for t, entry in old_window.items],
+                         ['start **'])
+        timelog.append('oops', now=datetime.datetime.combine(day, datetime.time(9, 30)))
+        self.assertEqual([entry for t, entry in timelog.window.items],
+                         ['start **', 'oops', 'work'])
+
+    def test_append_after_back_dated_entry_updates_cached_windows(self):
+        timelog = TimeLog(self.tempfile(), datetime.time(2, 0))
+        day = datetime.date(2014, 11, 12)
+        self.assertEqual(timelog.window_for_day(day).items, [])
+        self.assertEqual(timelog.window_for_week(day).items, [])
+        timelog.append('late night', now=datetime.datetime(2014, 11, 12, 1, 55))
+        timelog.append('arrived', now=datetime.datetime(2014, 11, 12, 9, 0))
+        self.assertEqual([entry for t, entry in timelog.window_for_day(day).items],
+                         ['arrived'])
+        self.assertEqual([entry for t, entry in timelog.window_for_week(day).items],
+                         ['late night', 'arrived'])
+
+    @freezegun.freeze_time("2014-11-12 12:00")
+    def test_append_after_back_dated_entry_updates_todays_window(self):
+        timelog = TimeLog(self.tempfile(), datetime.time(2, 0))
+        timelog.append('late night', now=datetime.datetime(2014, 11, 12, 1, 55))
+        timelog.append('arrived', now=datetime.datetime(2014, 11, 12, 9, 0))
+        self.assertEqual([entry for t, entry in timelog.window.items],
+                         ['arrived'])
+
+    @freezegun.freeze_time("2014-11-12 12:00")
+    def test_append_past_virtual_midnight_updates_todays_window(self):
+        timelog = TimeLog(self.tempfile(), datetime.time(2, 0))
+        timelog.append('arrived', now=datetime.datetime(2014, 11, 12, 9, 0))
+        timelog.append('overtime', now=datetime.datetime(2014, 11, 13, 3, 0))
+        self.assertEqual([entry for t, entry in timelog.window.items],
+                         ['arrived', 'overtime'])
+
+    def test_cached_windows_match_a_fresh_reload(self):
+        rng = random.Random(42)
+        timelog = TimeLog(self.tempfile(), datetime.time(2, 0))
+        timelog.window_cache_size = 100
+        start = datetime.datetime(2014, 11, 10, 0, 0)
+        days = [datetime.date(2014, 11, d) for d in range(9, 16)]
+        for step in range(100):
+            if timelog.items and rng.random() < 0.2:
+                timelog.remove_last_entry()
+            else:
+                last = timelog.last_time() or start
+                now = last + datetime.timedelta(minutes=rng.randrange(-60, 600))
+                timelog.append('entry %d' % step, now=now)
+            fresh = TimeLog(timelog.filename, datetime.time(2, 0))
+            for day in days:
+                for kind in ['day', 'week', 'month']:
+                    window = getattr(timelog, 'window_for_' + kind)(day)
+                    expected = getattr(fresh, 'window_for_' + kind)(day)
+                    self.assertEqual(list(window.items), list(expected.items))
+
+    def assertAggregatesUpToDate(self, collection):
+        cached = collection.aggregate()
+        fresh = Aggregates(collection)
+        self.assertEqual(cached.totals(), fresh.totals())
+        self.assertEqual(cached.days, fresh.days)
+        self.assertEqual(cached.tags, fresh.tags)
+        self.assertEqual(cached.tag_totals, fresh.tag_totals)
+        self.assertEqual(cached.grouped_entries(), fresh.grouped_entries())
+
+    def test_windows_are_cached(self):
+        timelog = TimeLog(self.tempfile(), datetime.time(2, 0))
+        day = datetime.date(2014, 11, 12)
+        self.assertIs(timelog.window_for_day(day), timelog.window_for_day(day))
+        self.assertIsNot(timelog.window_for_day(day),
+                         timelog.window_for_week(day))
+
+    def test_window_cache_is_bounded(self):
+        timelog = TimeLog(self.tempfile(), datetime.time(2, 0))
+        timelog.window_cache_size = 2
+        day = datetime.date(2014, 11, 12)
+        # today's window is cached too
+        window = timelog.window_for_day(day)
+        timelog.window_for_week(day)
+        self.assertIs(timelog.window_for_day(day), window)
+        timelog.window_for_month(day)
+        self.assertIs(timelog.window_for_day(day), window)
+        timelog.window_for_week(day)
+        timelog.window_for_month(day)
+        self.assertIsNot(timelog.window_for_day(day), window)
+
+    def test_window_cache_depends_on_virtual_midnight(self):
+        timelog = TimeLog(self.tempfile(), datetime.time(2, 0))
+        day = datetime.date(2014, 11, 12)
+        window = timelog.window_for_day(day)
+        timelog.virtual_midnight = datetime.time(5, 0)
+        self.assertIsNot(timelog.window_for_day(day), window)
+        self.assertEqual(timelog.window_for_day(day).min_timestamp,
+                         datetime.datetime(2014, 11, 12, 5, 0))
+
+    def test_reread_clears_caches(self):
+        filename = self.write_file('timelog.txt',
+                                   '2014-11-12 10:00: start **\n')
+        timelog = TimeLog(filename, datetime.time(2, 0))
+        day = datetime.date(2014, 11, 12)
+        window = timelog.window_for_day(day)
+        aggregates = timelog.aggregate()
+        version = timelog.version
+        timelog.reread()
+        self.assertGreater(timelog.version, version)
+        self.assertIsNot(timelog.window_for_day(day), window)
+        self.assertIsNot(timelog.aggregate(), aggregates)
+
+    def test_reloading_appended_lines_clears_caches(self):
+        filename = self.write_file('timelog.txt',
+                                   '2014-11-12 10:00: start **\n')
+        timelog = TimeLog(filename, datetime.time(2, 0))
+        day = datetime.date(2014, 11, 12)
+        window = timelog.window_for_day(day)
+        with open(filename, 'a') as f:
+            f.write('2014-11-12 11:00: work\n')
+        self.touch(filename)
+        self.assertTrue(timelog.check_reload())
+        self.assertEqual(len(timelog.window_for_day(day).items), 2)
+        self.assertEqual(len(window.items), 1)
+        self.assertAggregatesUpToDate(timelog)
+
+    def test_append_updates_aggregates_incrementally(self):
+        timelog = TimeLog(self.tempfile(), datetime.time(2, 0))
+        day = datetime.date(2014, 11, 12)
+        timelog.append('start **', now=datetime.datetime(2014, 11, 12, 9, 0))
+        timelog.append('work -- tag', now=datetime.datetime(2014, 11, 12, 10, 0))
+        aggregates = timelog.aggregate()
+        window = timelog.window_for_day(day)
+        week = timelog.window_for_week(day)
+        window_aggregates = window.aggregate()
+        week.aggregate()
+        other_day = timelog.window_for_day(datetime.date(2014, 11, 11))
+        timelog.append('more work -- tag', now=datetime.datetime(2014, 11, 12, 11, 0))
+        self.assertIs(timelog.aggregate(), aggregates)
+        self.assertAggregatesUpToDate(timelog)
+        # windows are replaced with new, extended ones
+        new_window = timelog.window_for_day(day)
+        self.assertIsNot(new_window, window)
+        self.assertEqual(len(new_window.items), 3)
+        self.assertAggregatesUpToDate(new_window)
+        self.assertAggregatesUpToDate(timelog.window_for_week(day))
+        # old windows remain unchanged
+        self.assertEqual(len(window.items), 2)
+        self.assertIs(window.aggregate(), window_aggregates)
+        self.assertEqual(window_aggregates.totals()[0],
+                         datetime.timedelta(hours=1))
+        # unaffected windows stay cached
+        self.assertIs(timelog.window_for_day(datetime.date(2014, 11, 11)),
+                      other_day)
+
+    def test_append_updates_uncached_aggregates(self):
+        timelog = TimeLog(self.tempfile(), datetime.time(2, 0))
+        day = timelog.virtual_today()
+        timelog.append('start **', now=datetime.datetime.combine(day, datetime.time(9, 0)))
+        timelog.append('work', now=datetime.datetime.combine(day, datetime.time(10, 0)))
+        self.assertEqual(len(timelog.window.items), 2)
+        self.assertAggregatesUpToDate(timelog)
+        self.assertAggregatesUpToDate(timelog.window)
+
+    def test_append_out_of_order_recomputes_aggregates(self):
+        timelog = TimeLog(self.tempfile(), datetime.time(2, 0))
+        day = datetime.date(2014, 11, 12)
+        timelog.append('start **', now=datetime.datetime(2014, 11, 12, 9, 0))
+        timelog.append('work', now=datetime.datetime(2014, 11, 12, 11, 0))
+        aggregates = timelog.aggregate()
+        window = timelog.window_for_day(day)
+        window.aggregate()
+        timelog.append('oops', now=datetime.datetime(2014, 11, 12, 10, 0))
+        self.assertIsNot(timelog.aggregate(), aggregates)
+        self.assertIsNot(timelog.window_for_day(day), window)
+        self.assertAggregatesUpToDate(timelog)
+        self.assertAggregatesUpToDate(timelog.window_for_day(day))
+
     @freezegun.freeze_time("2015-05-12 16:27:35.115265")
     def test_append_rounds_the_time(self):
         timelog = TimeLog(self.tempfile(), datetime.time(2, 0))
@@ -1228,6 +2122,100 @@ class TestTimeLog(Mixins, unittest.TestCase):
                 ##2018-12-09 12:15: coding
             """))
 
+    @freezegun.freeze_time("2018-12-09 16:27")
+    def test_remove_last_entry_reads_only_the_end(self):
+        filename = self.write_file('timelog.txt', textwrap.dedent("""\
+            2018-12-09 08:30: start at home
+            2018-12-09 12:15: coding
+            2018-12-09 12:15: coding
+            2018-12-09 08:40: emails
+        """) + '# a long comment\n' * 10)
+        variants = [{}, dict(compact=True)]
+        if sys.platform != 'win32':
+            # Windows doesn't let us replace a file that is memory-mapped
+            variants.append(dict(use_mmap=True))
+        for kw in variants:
+            with open(filename, 'rb') as f:
+                before = f.read()
+            timelog = TimeLog(filename, datetime.time(2, 0), **kw)
+            self.addCleanup(timelog.close)
+            window = timelog.window
+            with mock.patch.object(TimeLog, 'chunk_size', 16):
+                self.assertIsNotNone(timelog.remove_last_entry())
+            self.assertEqual(timelog.items,
+                             TimeLog(filename, datetime.time(2, 0)).items)
+            self.assertEqual(timelog.window.items, timelog.items)
+            self.assertEqual(len(window.items), len(timelog.items) + 1)
+            self.assertFalse(timelog.check_reload())
+            timelog.append('lunch **', datetime.datetime(2018, 12, 9, 13, 0))
+            with open(filename, 'ab') as f:
+                f.write(b'2018-12-09 14:00: more coding\n')
+            self.assertTrue(timelog.check_reload())
+            self.assertEqual(timelog.reload_stats['appended'], 1)
+            self.assertEqual(timelog.items,
+                             TimeLog(filename, datetime.time(2, 0)).items)
+            timelog.close()
+            with open(filename, 'wb') as f:
+                f.write(before)
+        timelog = TimeLog(filename, datetime.time(2, 0))
+        self.assertEqual(timelog.remove_last_entry(), 'emails')
+        self.assertEqual(timelog.remove_last_entry(), 'coding')
+        self.assertEqual(timelog.items, [
+            (datetime.datetime(2018, 12, 9, 8, 30), 'start at home'),
+            (datetime.datetime(2018, 12, 9, 12, 15), 'coding'),
+        ])
+
+    @unittest.skipIf(sys.platform == 'win32',
+                     "symlinks need special privileges on Windows")
+    @freezegun.freeze_time("2018-12-09 16:27")
+    def test_remove_last_entry_replaces_the_file(self):
+        filename = self.write_file('real.txt', textwrap.dedent("""\
+            2018-12-09 08:30: start at home
+            2018-12-09 12:15: coding
+        """))
+        os.chmod(filename, 0o640)
+        symlink = self.tempfile('timelog.txt')
+        os.symlink(filename, symlink)
+        timelog = TimeLog(symlink, datetime.time(2, 0))
+        self.assertEqual(timelog.remove_last_entry(), 'coding')
+        self.assertTrue(os.path.islink(symlink))
+        self.assertEqual(os.stat(filename).st_mode & 0o777, 0o640)
+        self.assertEqual(sorted(os.listdir(self.tempdir)),
+                         ['real.txt', 'timelog.txt'])
+        with open(filename) as f:
+            self.assertEqual(f.read(), textwrap.dedent("""\
+                2018-12-09 08:30: start at home
+                ##2018-12-09 12:15: coding
+            """))
+        self.assertFalse(timelog.check_reload())
+
+    @freezegun.freeze_time("2018-12-09 16:27")
+    def test_remove_last_entry_syncs_the_directory(self):
+        filename = self.write_file('timelog.txt', textwrap.dedent("""\
+            2018-12-09 08:30: start at home
+            2018-12-09 12:15: coding
+        """))
+        timelog = TimeLog(filename, datetime.time(2, 0))
+        with mock.patch('gtimelog.timelog.fsync_dir',
+                        wraps=fsync_dir) as fsync:
+            self.assertEqual(timelog.remove_last_entry(), 'coding')
+        fsync.assert_called_once_with(os.path.realpath(self.tempdir))
+
+    @freezegun.freeze_time("2018-12-09 16:27")
+    def test_remove_last_entry_failure(self):
+        TEST_TIMELOG = textwrap.dedent("""\
+            2018-12-09 08:30: start at home
+            2018-12-09 12:15: coding
+        """)
+        filename = self.write_file('timelog.txt', TEST_TIMELOG)
+        timelog = TimeLog(filename, datetime.time(2, 0))
+        with mock.patch('os.replace', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                timelog.remove_last_entry()
+        self.assertEqual(os.listdir(self.tempdir), ['timelog.txt'])
+        with open(filename) as f:
+            self.assertEqual(f.read(), TEST_TIMELOG)
+
     @freezegun.freeze_time("2018-12-10 10:40")
     def test_remove_last_entry_start_of_day(self):
 
@@ -1385,6 +2373,734 @@ class TestTimeLog(Mixins, unittest.TestCase):
                          ("+200 did stuff", None))
 
 
+class TestStreamedWindow(Mixins, unittest.TestCase):
+
+    TEST_TIMELOG = textwrap.dedent("""\
+        2014-05-27 10:03: arrived
+        2014-05-27 10:13: edx: introduce topic to new sysadmins -- edx
+        2014-05-27 10:30: email
+        2014-05-27 12:11: meeting: how to support new courses?
+        2014-05-27 15:12: edx: write test procedure for EdX instances -- edx sysadmin
+        2014-05-27 17:03: cyber: testing
+        2014-05-27 17:53: cyber: design
+        2014-05-27 20:53: cyber: design
+        2014-05-27 23:30: lunch **
+
+        2014-05-28 09:00: arrived
+        2014-05-28 10:00: email
+        2014-05-28 12:00: cyber: testing -- bug
+    """)
+
+    def test_reports(self):
+        filename = self.write_file('timelog.txt', self.TEST_TIMELOG)
+        timelog = TimeLog(filename, datetime.time(2, 0))
+        min = datetime.datetime(2014, 5, 26, 2, 0)
+        max = datetime.datetime(2014, 6, 2, 2, 0)
+        window = timelog.stream_window(min, max)
+        self.assertIsInstance(window, StreamedWindow)
+        self.assertEqual(window.virtual_midnight, datetime.time(2, 0))
+        for style in ['plain', 'categorized']:
+            for method in ['weekly_report', 'monthly_report',
+                           'custom_range_report_categorized']:
+                expected = StringIO()
+                getattr(Reports(timelog.window_for(min, max), style=style),
+                        method)(expected, 'foo@bar.com', 'Bob')
+                output = StringIO()
+                getattr(Reports(window, style=style),
+                        method)(output, 'foo@bar.com', 'Bob')
+                self.assertEqual(output.getvalue(), expected.getvalue())
+
+
+class TestCompactTimeLog(Mixins, unittest.TestCase):
+
+    TEST_TIMELOG = textwrap.dedent("""\
+        2018-12-09 08:30: start at home **
+        2018-12-09 08:40: emails
+        2018-12-09 12:15: coding
+    """)
+
+    def setUp(self):
+        self.filename = self.write_file('timelog.txt', self.TEST_TIMELOG)
+        self.timelog = TimeLog(self.filename, datetime.time(2, 0), compact=True)
+
+    def expected_items(self):
+        return TimeLog(self.filename, datetime.time(2, 0)).items
+
+    def test_reread(self):
+        self.assertIsInstance(self.timelog.items, CompactItems)
+        self.assertEqual(self.timelog.items, self.expected_items())
+        window = self.timelog.window_for_day(datetime.date(2018, 12, 9))
+        self.assertEqual(window.items, self.expected_items())
+        self.assertEqual(window.totals(),
+                         (datetime.timedelta(hours=3, minutes=45),
+                          datetime.timedelta(0)))
+
+    def test_reloading_appended_lines(self):
+        with open(self.filename, 'a') as f:
+            f.write('2018-12-09 13:00: lunch **\n')
+        self.touch(self.filename)
+        self.assertTrue(self.timelog.check_reload())
+        self.assertEqual(self.timelog.items, self.expected_items())
+        with open(self.filename, 'a') as f:
+            f.write('2018-12-09 08:35: coffee **\n')
+        self.touch(self.filename)
+        self.assertTrue(self.timelog.check_reload())
+        self.assertIsInstance(self.timelog.items, CompactItems)
+        self.assertEqual(self.timelog.items, self.expected_items())
+
+    def test_append(self):
+        self.timelog.append('lunch **', now=datetime.datetime(2018, 12, 9, 13, 0))
+        self.assertEqual(self.timelog.items, self.expected_items())
+        self.timelog.append('coffee **', now=datetime.datetime(2018, 12, 9, 8, 35))
+        self.assertIsInstance(self.timelog.items, CompactItems)
+        self.assertEqual(self.timelog.items, self.expected_items())
+        window = self.timelog.window_for_day(datetime.date(2018, 12, 9))
+        self.assertEqual([entry for t, entry in window.items],
+                         ['start at home **', 'coffee **', 'emails',
+                          'coding', 'lunch **'])
+
+    def touch(self, filename):
+        st = os.stat(filename)
+        os.utime(filename, (st.st_atime, st.st_mtime + 1))
+
+
+class TestMappedTimeLog(TestCompactTimeLog):
+
+    def setUp(self):
+        self.filename = self.write_file('timelog.txt', self.TEST_TIMELOG)
+        self.timelog = TimeLog(self.filename, datetime.time(2, 0), use_mmap=True)
+
+    def test_entries_are_decoded_on_demand(self):
+        self.assertEqual(self.timelog.items.strings, [])
+        self.timelog.last_entry()
+        self.assertEqual(sorted(self.timelog.items.strings), ['coding', 'emails'])
+
+    def test_empty_file(self):
+        self.write_file('timelog.txt', '')
+        self.timelog.reread()
+        self.assertEqual(self.timelog.items, [])
+        self.timelog.append('start **', now=datetime.datetime(2018, 12, 9, 8, 30))
+        self.assertEqual(self.timelog.items, self.expected_items())
+
+    def test_missing_file(self):
+        os.unlink(self.filename)
+        self.timelog.reread()
+        self.assertEqual(self.timelog.items, [])
+
+    def test_mac_line_endings(self):
+        with open(self.filename, 'w', newline='\r') as f:
+            f.write(self.TEST_TIMELOG)
+        self.timelog.reread()
+        self.assertEqual(self.timelog.items, self.expected_items())
+        self.assertEqual(len(self.timelog.items), 3)
+
+    def test_windows_line_endings(self):
+        with open(self.filename, 'w', newline='\r\n') as f:
+            f.write(self.TEST_TIMELOG)
+        self.timelog.reread()
+        self.assertEqual(self.timelog.items, self.expected_items())
+        self.assertEqual(self.timelog.items[0][1], 'start at home **')
+
+
+class TestPartialTimeLog(Mixins, unittest.TestCase):
+
+    def setUp(self):
+        lines = []
+        for day in range(1, 29):
+            lines.append('2018-02-%02d 09:00: arrived **\n' % day)
+            lines.append('2018-02-%02d 17:00: day %d\n' % (day, day))
+            lines.append('\n')
+        self.filename = self.write_file('timelog.txt', ''.join(lines))
+        self.full = TimeLog(self.filename, datetime.time(2, 0))
+
+    def make_timelog(self, since, chunk_size=64, **kw):
+        with mock.patch.object(TimeLog, 'chunk_size', chunk_size):
+            return TimeLog(self.filename, datetime.time(2, 0),
+                           since=since, **kw)
+
+    def assertLoadedSince(self, timelog, since, full=None):
+        items = (full or self.full).items
+        self.assertEqual(timelog.items, items[-len(timelog.items):])
+        self.assertLess(timelog.items[0][0], since)
+
+    def test_reads_only_the_end(self):
+        timelog = self.make_timelog(datetime.datetime(2018, 2, 26, 2, 0))
+        self.assertFalse(timelog.complete)
+        self.assertLess(len(timelog.items), len(self.full.items))
+        self.assertLess(timelog.items[0][0],
+                        datetime.datetime(2018, 2, 26, 2, 0))
+        self.assertEqual(timelog.items,
+                         self.full.items[-len(timelog.items):])
+        week = datetime.date(2018, 2, 26)
+        self.assertEqual(timelog.window_for_week(week).items,
+                         self.full.window_for_week(week).items)
+
+    def test_reads_everything_if_needed(self):
+        timelog = self.make_timelog(datetime.datetime(2018, 1, 1, 2, 0))
+        self.assertTrue(timelog.complete)
+        self.assertEqual(timelog.items, self.full.items)
+
+    def test_long_lines(self):
+        with open(self.filename, 'a') as f:
+            f.write('2018-02-28 18:00: %s\n' % ('x' * 1000))
+            f.write('this is not an entry\n')
+        since = datetime.datetime(2018, 2, 28, 2, 0)
+        timelog = self.make_timelog(since)
+        self.assertLoadedSince(timelog, since,
+                               TimeLog(self.filename, datetime.time(2, 0)))
+
+    def test_reread_loads_everything(self):
+        timelog = self.make_timelog(datetime.datetime(2018, 2, 26, 2, 0))
+        timelog.reread()
+        self.assertTrue(timelog.complete)
+        self.assertEqual(timelog.items, self.full.items)
+
+    def test_reloading_appended_lines(self):
+        timelog = self.make_timelog(datetime.datetime(2018, 2, 26, 2, 0),
+                                    compact=True)
+        timelog.append('lunch **', now=datetime.datetime(2018, 2, 28, 13, 0))
+        with open(self.filename, 'a') as f:
+            f.write('2018-02-28 18:00: overtime\n')
+        os.utime(self.filename, (0, 0))
+        self.assertTrue(timelog.check_reload())
+        self.assertFalse(timelog.complete)
+        self.assertEqual(timelog.items[-3:], [
+            (datetime.datetime(2018, 2, 28, 13, 0), 'lunch **'),
+            (datetime.datetime(2018, 2, 28, 17, 0), 'day 28'),
+            (datetime.datetime(2018, 2, 28, 18, 0), 'overtime'),
+        ])
+
+    def test_missing_file(self):
+        timelog = TimeLog(self.tempfile('nosuchfile.txt'), datetime.time(2, 0),
+                          since=datetime.datetime(2018, 2, 26, 2, 0))
+        self.assertEqual(timelog.items, [])
+        self.assertTrue(timelog.complete)
+
+    def test_no_entries_in_first_chunk(self):
+        with open(self.filename, 'a') as f:
+            f.write('\n' * 100)
+        since = datetime.datetime(2018, 2, 28, 2, 0)
+        timelog = self.make_timelog(since)
+        self.assertLoadedSince(timelog, since)
+
+    def test_no_newlines_in_first_chunk(self):
+        with open(self.filename, 'a') as f:
+            f.write('2018-02-28 18:00: no newline at the end')
+        since = datetime.datetime(2018, 2, 28, 2, 0)
+        timelog = self.make_timelog(since, chunk_size=10)
+        self.assertLoadedSince(timelog, since,
+                               TimeLog(self.filename, datetime.time(2, 0)))
+
+    def test_parse_cache_is_not_bypassed(self):
+        timelog = TimeLog(self.filename, datetime.time(2, 0),
+                          cache_filename=self.tempfile('cache'),
+                          since=datetime.datetime(2018, 2, 26, 2, 0))
+        self.assertTrue(timelog.complete)
+        self.assertEqual(timelog.items, self.full.items)
+
+    def test_first_timestamp(self):
+        ft = TimeLog._first_timestamp
+        self.assertIsNone(ft(b''))
+        self.assertIsNone(ft(b'\n'))
+        self.assertIsNone(ft(b'\nnot an entry\n2018-02-30 10:00: bad date\n'))
+        self.assertEqual(
+            ft(b'xx: yy\n2018-02-01  9:00: lenient\n'),
+            ft(b'2018-02-01 09:00: strict\n'))
+
+
+class TestShardedTimeLog(Mixins, unittest.TestCase):
+
+    TEST_TIMELOG = textwrap.dedent("""\
+        # my time log
+        2017-12-29 09:00: arrived **
+        2017-12-29 17:00: work
+
+        2018-06-01 09:00: arrived **
+        2018-06-01 17:00: work
+        # note: not an entry
+
+        2018-12-31 09:00: arrived **
+        2018-12-31 23:00: new year's eve party **
+        2019-01-01 01:00: more party **
+
+        2019-01-02 09:00: arrived **
+        2019-01-02 12:00: work
+    """)
+
+    def setUp(self):
+        self.filename = self.write_file('timelog.txt', self.TEST_TIMELOG)
+        self.dirname = os.path.join(self.mkdtemp(), 'timelog.d')
+        split_timelog(self.filename, self.dirname)
+        self.full = TimeLog(self.filename, datetime.time(2, 0))
+
+    def read(self, year):
+        with open(os.path.join(self.dirname, '%d.txt' % year)) as f:
+            return f.read()
+
+    def test_split_timelog(self):
+        self.assertEqual(sorted(os.listdir(self.dirname)),
+                         ['2017.txt', '2018.txt', '2019.txt'])
+        self.assertEqual(self.read(2017), textwrap.dedent("""\
+            # my time log
+            2017-12-29 09:00: arrived **
+            2017-12-29 17:00: work
+
+        """))
+        self.assertEqual(self.read(2019), textwrap.dedent("""\
+            2019-01-01 01:00: more party **
+
+            2019-01-02 09:00: arrived **
+            2019-01-02 12:00: work
+        """))
+
+    def test_split_timelog_does_not_overwrite_files(self):
+        with self.assertRaises(FileExistsError):
+            split_timelog(self.filename, self.dirname)
+
+    def test_split_timelog_without_entries(self):
+        filename = self.write_file('empty.txt', '# nothing here\n')
+        dirname = os.path.join(self.tempdir, 'empty.d')
+        self.assertEqual(split_timelog(filename, dirname), [])
+        self.assertEqual(os.listdir(dirname), [])
+
+    @freezegun.freeze_time("2019-01-02 13:00")
+    def test_loads_only_the_current_shard(self):
+        timelog = ShardedTimeLog(self.dirname, datetime.time(2, 0))
+        self.assertEqual(timelog.filename, os.path.join(self.dirname, '2019.txt'))
+        self.assertFalse(timelog.complete)
+        self.assertEqual(timelog.items, self.full.items[-3:])
+        self.assertEqual(timelog.window.items, self.full.items[-2:])
+
+    @freezegun.freeze_time("2019-01-02 13:00")
+    def test_windows_load_the_shards_they_need(self):
+        timelog = ShardedTimeLog(self.dirname, datetime.time(2, 0))
+        day = datetime.date(2018, 12, 31)
+        self.assertEqual(timelog.window_for_day(day).items,
+                         self.full.window_for_day(day).items)
+        self.assertEqual(sorted(timelog._history), [2018])
+        self.assertFalse(timelog.complete)
+        self.assertEqual(timelog.window.items, self.full.items[-2:])
+        month = datetime.date(2017, 12, 1)
+        self.assertEqual(timelog.window_for_month(month).items,
+                         self.full.window_for_month(month).items)
+        self.assertTrue(timelog.complete)
+        self.assertEqual(timelog.items, self.full.items)
+
+    @freezegun.freeze_time("2019-01-02 13:00")
+    def test_append(self):
+        timelog = ShardedTimeLog(self.dirname, datetime.time(2, 0))
+        timelog.window_for_day(datetime.date(2018, 12, 31))
+        timelog.append('lunch **')
+        self.assertEqual(timelog.window.items[-1],
+                         (datetime.datetime(2019, 1, 2, 13, 0), 'lunch **'))
+        self.assertTrue(self.read(2019).endswith('2019-01-02 13:00: lunch **\n'))
+        self.assertFalse(timelog.check_reload())
+        self.assertEqual(sorted(timelog._history), [2018])
+
+    def test_new_year(self):
+        with freezegun.freeze_time("2018-12-31 23:30") as frozen:
+            os.unlink(os.path.join(self.dirname, '2019.txt'))
+            timelog = ShardedTimeLog(self.dirname, datetime.time(2, 0))
+            self.assertEqual(timelog.filename,
+                             os.path.join(self.dirname, '2018.txt'))
+            frozen.move_to("2019-01-01 00:30")
+            self.assertIsNone(timelog.remove_last_entry())
+            timelog.append('still partying **')
+            self.assertEqual(timelog.filename,
+                             os.path.join(self.dirname, '2019.txt'))
+            self.assertEqual(self.read(2019),
+                             '2019-01-01 00:30: still partying **\n')
+            self.assertEqual(timelog.window.items[-3:], [
+                (datetime.datetime(2018, 12, 31, 9, 0), 'arrived **'),
+                (datetime.datetime(2018, 12, 31, 23, 0),
+                 "new year's eve party **"),
+                (datetime.datetime(2019, 1, 1, 0, 30), 'still partying **'),
+            ])
+            self.assertEqual(timelog.remove_last_entry(), 'still partying **')
+
+    def test_append_in_a_new_year(self):
+        with freezegun.freeze_time("2018-12-31 23:30") as frozen:
+            os.unlink(os.path.join(self.dirname, '2019.txt'))
+            timelog = ShardedTimeLog(self.dirname, datetime.time(2, 0))
+            self.addCleanup(timelog.close)
+            timelog.append('fireworks **')
+            frozen.move_to("2019-01-01 00:30")
+            timelog.append('still partying **')
+            self.assertTrue(self.read(2018).endswith(
+                '2018-12-31 23:30: fireworks **\n'))
+            self.assertEqual(self.read(2019),
+                             '2019-01-01 00:30: still partying **\n')
+
+    @freezegun.freeze_time("2019-01-02 13:00")
+    def test_back_dated_entries_go_to_their_shard(self):
+        timelog = ShardedTimeLog(self.dirname, datetime.time(2, 0))
+        self.addCleanup(timelog.close)
+        timelog.shard_cache_size = 0
+        timelog.window_for_day(datetime.date(2017, 12, 29))
+        timelog.append_many([
+            (datetime.datetime(2018, 12, 31, 23, 50), 'fireworks **'),
+            (datetime.datetime(2016, 12, 31, 23, 50), 'more fireworks **'),
+            (None, 'lunch **'),
+        ])
+        self.assertTrue(self.read(2018).endswith(
+            '2018-12-31 23:50: fireworks **\n'))
+        self.assertEqual(self.read(2016),
+                         '\n2016-12-31 23:50: more fireworks **\n')
+        self.assertTrue(self.read(2019).endswith('2019-01-02 13:00: lunch **\n'))
+        self.assertFalse(timelog.check_reload())
+        self.assertEqual(list(timelog._history), [2016])
+        self.assertEqual(timelog.items[0],
+                         (datetime.datetime(2016, 12, 31, 23, 50),
+                          'more fireworks **'))
+        self.assertEqual(timelog.window.items[-1][1], 'lunch **')
+        # still there when 2019 becomes an older shard
+        with mock.patch.object(ShardedTimeLog, 'current_year',
+                               return_value=2020):
+            later = ShardedTimeLog(self.dirname, datetime.time(2, 0))
+            self.assertEqual(
+                later.window_for_day(datetime.date(2018, 12, 31)).items[-2:],
+                [(datetime.datetime(2018, 12, 31, 23, 50), 'fireworks **'),
+                 (datetime.datetime(2019, 1, 1, 1, 0), 'more party **')])
+
+    @freezegun.freeze_time("2019-01-02 13:00")
+    def test_back_dated_entries_fsync(self):
+        timelog = ShardedTimeLog(self.dirname, datetime.time(2, 0))
+        timelog.fsync = TimeLog.FSYNC_ENTRY
+        with mock.patch('os.fsync') as fsync:
+            timelog.append('fireworks **',
+                           datetime.datetime(2018, 12, 31, 23, 50))
+        fsync.assert_called_once()
+
+    @freezegun.freeze_time("2019-01-02 13:00")
+    def test_old_shards_are_unloaded(self):
+        timelog = ShardedTimeLog(self.dirname, datetime.time(2, 0))
+        timelog.shard_cache_size = 1
+        # this belongs to the 2018 shard, but is in the current one
+        with open(os.path.join(self.dirname, '2019.txt'), 'a') as f:
+            f.write('2018-12-31 22:00: forgot this **\n')
+        timelog.check_reload()
+        full = TimeLog(self.filename, datetime.time(2, 0))
+        full.append('forgot this **', datetime.datetime(2018, 12, 31, 22, 0))
+        current_shard = [full.items[5]] + full.items[7:]
+        self.assertEqual(timelog.items, current_shard)
+        day = datetime.date(2018, 12, 31)
+        old_day = datetime.date(2017, 12, 29)
+        self.assertEqual(timelog.window_for_day(day).items,
+                         full.window_for_day(day).items)
+        self.assertEqual(timelog.window_for_day(old_day).items,
+                         full.window_for_day(old_day).items)
+        self.assertEqual(list(timelog._history), [2017])
+        self.assertEqual(timelog.items, full.items[:2] + current_shard)
+        self.assertFalse(timelog.complete)
+        self.assertEqual(timelog.window_for_day(day).items,
+                         full.window_for_day(day).items)
+        self.assertEqual(list(timelog._history), [2018])
+        self.assertEqual(timelog.items, full.items[2:])
+        self.assertEqual(timelog.window.items, full.items[-2:])
+        # a window that needs more shards than we usually keep
+        whole = timelog.window_for(datetime.datetime(2017, 1, 1),
+                                   datetime.datetime(2020, 1, 1))
+        self.assertEqual(whole.items, full.items)
+        self.assertEqual(list(timelog._history), [2018, 2017])
+        timelog.window_for_day(datetime.date(2018, 6, 1))
+        self.assertEqual(list(timelog._history), [2017, 2018])
+        # the last day of a month needs the next year's shard, because of
+        # virtual midnight
+        timelog.window_for_month(datetime.date(2017, 12, 1))
+        self.assertEqual(list(timelog._history), [2017, 2018])
+
+    @freezegun.freeze_time("2019-01-02 13:00")
+    def test_unloading_keeps_equal_entries_of_the_current_shard(self):
+        timelog = ShardedTimeLog(self.dirname, datetime.time(2, 0))
+        timelog.shard_cache_size = 1
+        arrived = (datetime.datetime(2018, 12, 31, 9, 0), 'arrived **')
+        with open(os.path.join(self.dirname, '2019.txt'), 'a') as f:
+            f.write('2018-12-31 09:00: arrived **\n')
+        timelog.check_reload()
+        day = datetime.date(2018, 12, 31)
+        self.assertEqual(timelog.window_for_day(day).items.count(arrived), 2)
+        # only the number of items is kept, not a copy of them
+        self.assertEqual(timelog._history[2018][1], 4)
+        timelog.window_for_day(datetime.date(2017, 12, 29))
+        self.assertEqual(list(timelog._history), [2017])
+        self.assertEqual(timelog.items.count(arrived), 1)
+
+    @freezegun.freeze_time("2019-01-02 13:00")
+    def test_changes_to_old_shards_are_noticed(self):
+        timelog = ShardedTimeLog(self.dirname, datetime.time(2, 0))
+        self.assertFalse(timelog.check_reload())
+        timelog.window_for_day(datetime.date(2018, 12, 31))
+        with open(os.path.join(self.dirname, '2018.txt'), 'a') as f:
+            f.write('2018-12-31 23:30: fireworks **\n')
+        self.assertTrue(timelog.check_reload())
+        self.assertEqual(timelog._history, {})
+        self.assertEqual(
+            timelog.window_for_day(datetime.date(2018, 12, 31)).items[-2:],
+            [(datetime.datetime(2018, 12, 31, 23, 30), 'fireworks **'),
+             (datetime.datetime(2019, 1, 1, 1, 0), 'more party **')])
+
+    @freezegun.freeze_time("2019-01-02 13:00")
+    def test_stream_window(self):
+        timelog = ShardedTimeLog(self.dirname, datetime.time(2, 0))
+        timelog.window_for_day(datetime.date(2018, 6, 1))
+        for min, max in [
+                (datetime.datetime(2017, 1, 1), datetime.datetime(2020, 1, 1)),
+                (datetime.datetime(2017, 12, 29, 10, 0),
+                 datetime.datetime(2019, 1, 1, 2, 0)),
+                (datetime.datetime(2019, 1, 2, 10, 0),
+                 datetime.datetime(2019, 1, 3, 2, 0)),
+                (datetime.datetime(2016, 1, 1), datetime.datetime(2017, 1, 1)),
+        ]:
+            window = timelog.stream_window(min, max)
+            self.assertEqual(vars(window.aggregate()),
+                             vars(self.full.window_for(min, max).aggregate()))
+        self.assertEqual(list(timelog._history), [2018])
+
+    def test_no_shards(self):
+        timelog = ShardedTimeLog(os.path.join(self.tempdir, 'nosuchdir'),
+                                 datetime.time(2, 0))
+        self.assertEqual(timelog.items, [])
+        self.assertTrue(timelog.complete)
+
+
+class TestParseCache(Mixins, unittest.TestCase):
+
+    TEST_TIMELOG = textwrap.dedent("""\
+        2018-12-09 08:30: start at home
+        # comment: not an entry
+        2018-12-09 08:40:   emails  -- mail
+        2018-12-09 09:10: travel to work ***
+
+        2018-12-09 09:15: \N{SNOWMAN} **
+    """)
+
+    def setUp(self):
+        self.filename = self.write_file('timelog.txt', self.TEST_TIMELOG)
+        self.cache_filename = self.tempfile('timelog.cache')
+
+    def load(self):
+        return TimeLog(self.filename, datetime.time(2, 0),
+                       cache_filename=self.cache_filename)
+
+    def expected_items(self):
+        return TimeLog(self.filename, datetime.time(2, 0)).items
+
+    def append(self, text):
+        with open(self.filename, 'a', encoding='utf-8') as f:
+            f.write(text)
+
+    def test_cache_is_created(self):
+        self.assertEqual(self.load().items, self.expected_items())
+        self.assertTrue(os.path.exists(self.cache_filename))
+
+    def test_cache_is_used(self):
+        self.load()
+        with mock.patch.object(TimeLog, '_parse') as parse:
+            timelog = self.load()
+        parse.assert_not_called()
+        self.assertEqual(timelog.items, self.expected_items())
+
+    def test_only_appended_lines_are_parsed(self):
+        self.load()
+        self.append('2018-12-09 12:15: coding\n')
+        with mock.patch.object(TimeLog, '_read', side_effect=AssertionError):
+            timelog = self.load()
+        self.assertEqual(timelog.items, self.expected_items())
+        self.assertEqual(timelog.items[-1][1], 'coding')
+        self.assertEqual(self.load().items, self.expected_items())
+
+    def test_appended_lines_out_of_order(self):
+        self.load()
+        self.append('2018-12-09 08:35: coffee **\n')
+        timelog = self.load()
+        self.assertEqual(timelog.items, self.expected_items())
+        self.assertEqual(timelog.items[1][1], 'coffee **')
+
+    def test_cache_is_invalidated_by_edits(self):
+        self.load()
+        self.write_file('timelog.txt', self.TEST_TIMELOG.replace('home', 'work'))
+        timelog = self.load()
+        self.assertEqual(timelog.items, self.expected_items())
+        self.assertEqual(timelog.items[0][1], 'start at work')
+
+    def test_cache_is_invalidated_by_truncation(self):
+        self.load()
+        self.write_file('timelog.txt', '2018-12-09 08:30: start at home\n')
+        self.assertEqual(self.load().items, self.expected_items())
+
+    def test_incomplete_last_line_is_not_cached(self):
+        self.append('2018-12-09 12:15: cod')
+        self.assertEqual(self.load().items, self.expected_items())
+        self.assertFalse(os.path.exists(self.cache_filename))
+
+    def test_windows_line_endings(self):
+        with open(self.filename, 'w', encoding='utf-8', newline='\r\n') as f:
+            f.write(self.TEST_TIMELOG)
+        self.load()
+        self.assertEqual(self.load().items, self.expected_items())
+
+    def test_bad_cache_is_ignored(self):
+        for junk in [b'', b'junk', b'GTLCACHE' + b'\0' * 52]:
+            with open(self.cache_filename, 'wb') as f:
+                f.write(junk)
+            self.assertEqual(self.load().items, self.expected_items())
+
+    def test_truncated_cache_is_ignored(self):
+        self.load()
+        with open(self.cache_filename, 'r+b') as f:
+            f.truncate(os.path.getsize(self.cache_filename) - 1)
+        self.assertEqual(self.load().items, self.expected_items())
+
+    def test_cache_cannot_be_saved(self):
+        self.cache_filename = os.path.join(self.mkdtemp(), 'nosuchdir', 'cache')
+        self.assertEqual(self.load().items, self.expected_items())
+
+    def test_missing_timelog(self):
+        os.unlink(self.filename)
+        self.assertEqual(self.load().items, [])
+
+    def test_compact(self):
+        timelog = TimeLog(self.filename, datetime.time(2, 0),
+                          cache_filename=self.cache_filename, compact=True)
+        self.assertIsInstance(timelog.items, CompactItems)
+        self.assertEqual(timelog.items, self.expected_items())
+        self.append('2018-12-09 08:35: coffee **\n')
+        timelog = TimeLog(self.filename, datetime.time(2, 0),
+                          cache_filename=self.cache_filename, compact=True)
+        self.assertIsInstance(timelog.items, CompactItems)
+        self.assertEqual(timelog.items, self.expected_items())
+
+
+class TestAggregates(unittest.TestCase):
+
+    TEST_TIMELOG = textwrap.dedent("""
+        2014-05-27 10:03: arrived
+        2014-05-27 10:13: edx: introduce topic to new sysadmins -- edx
+        2014-05-27 10:30: email
+        2014-05-27 12:11: meeting: how to support new courses?  -- edx meeting
+        2014-05-27 17:36: off: pause ** -- edx
+        2014-05-27 17:38: email
+        2014-05-27 18:00: travel *** -- hpc
+        2014-05-27 19:06: off: dinner & family **
+
+        2014-05-28 09:00: arrived
+        2014-05-28 10:00: email
+        """)
+
+    def setUp(self):
+        self.tw = make_time_window(
+            StringIO(self.TEST_TIMELOG),
+            datetime.datetime(2014, 5, 27, 9, 0),
+            datetime.datetime(2014, 5, 28, 23, 59),
+            datetime.time(2, 0),
+        )
+        self.aggregates = self.tw.aggregate()
+
+    def test_first_entry(self):
+        self.assertEqual(self.aggregates.first_entry.entry, 'arrived')
+        self.assertIsNone(make_time_window().aggregate().first_entry)
+
+    def test_totals(self):
+        self.assertEqual(self.aggregates.totals(), (
+            datetime.timedelta(hours=3, minutes=10),
+            datetime.timedelta(hours=6, minutes=31),
+        ))
+
+    def test_tag_totals(self):
+        self.assertEqual(self.aggregates.totals('edx'), (
+            datetime.timedelta(hours=1, minutes=51),
+            datetime.timedelta(hours=5, minutes=25),
+        ))
+        self.assertEqual(self.aggregates.totals('hpc'), (
+            datetime.timedelta(0), datetime.timedelta(0),
+        ))
+        self.assertEqual(self.aggregates.tags, {'edx', 'meeting', 'hpc'})
+
+    def test_days(self):
+        self.assertEqual(self.aggregates.days, 2)
+
+    def test_grouped_entries(self):
+        work, slack = self.aggregates.grouped_entries()
+        self.assertEqual([entry for start, entry, duration in work], [
+            'edx: introduce topic to new sysadmins', 'email',
+            'meeting: how to support new courses?', 'arrived',
+        ])
+        self.assertEqual(work[-1], (datetime.datetime(2014, 5, 28, 9, 0),
+                                    'arrived', datetime.timedelta(0)))
+        self.assertEqual(work[1], (datetime.datetime(2014, 5, 27, 10, 13),
+                                   'email', datetime.timedelta(hours=1, minutes=19)))
+        self.assertEqual([entry for start, entry, duration in slack], [
+            'off: pause **', 'off: dinner & family **',
+        ])
+
+    def test_grouped_entries_without_skipping_first(self):
+        work, slack = self.aggregates.grouped_entries(skip_first=False)
+        self.assertEqual(work[0], (datetime.datetime(2014, 5, 27, 10, 3),
+                                   'arrived', datetime.timedelta(0)))
+        self.assertEqual(len(slack), 2)
+
+    def test_grouped_entries_do_not_include_skipped_first_entry(self):
+        tw = make_time_window(
+            StringIO('2014-05-27 10:03: travel ***\n'
+                     '2014-05-27 10:13: arrived **\n'),
+            datetime.datetime(2014, 5, 27, 9, 0),
+            datetime.datetime(2014, 5, 28, 23, 59))
+        work, slack = tw.grouped_entries(skip_first=False)
+        self.assertEqual(work, [])
+        self.assertEqual([entry for start, entry, duration in slack],
+                         ['arrived **'])
+
+    def test_categorized_work_entries(self):
+        entries, totals = self.tw.categorized_work_entries()
+        self.assertEqual(sorted(entries, key=str), [None, 'edx', 'meeting'])
+        self.assertEqual(totals['meeting'], datetime.timedelta(hours=1, minutes=41))
+
+    def test_totals_with_tag_and_filter(self):
+        self.assertEqual(self.tw.totals(tag='edx', filter_text='off'), (
+            datetime.timedelta(0), datetime.timedelta(hours=5, minutes=25),
+        ))
+        self.assertEqual(self.tw.totals(filter_text='travel'), (
+            datetime.timedelta(0), datetime.timedelta(0),
+        ))
+
+    def test_aggregates_are_cached(self):
+        self.assertIs(self.tw.aggregate(), self.aggregates)
+
+    def test_cache_invalidated_by_new_items(self):
+        self.tw.items = self.tw.items[:3]
+        self.assertIsNot(self.tw.aggregate(), self.aggregates)
+        self.assertEqual(self.tw.aggregate().days, 1)
+
+    def test_cache_invalidated_by_virtual_midnight(self):
+        self.tw.virtual_midnight = datetime.time(10, 1)
+        self.assertIsNot(self.tw.aggregate(), self.aggregates)
+        self.assertEqual(self.tw.aggregate().days, 1)
+
+    def test_cache_invalidated_by_changed(self):
+        self.tw.changed()
+        self.assertIsNot(self.tw.aggregate(), self.aggregates)
+
+    def test_copy(self):
+        work, slacking = self.aggregates.totals()
+        copy = self.aggregates.copy()
+        copy.add(self.tw.last_entry())
+        self.assertEqual(self.aggregates.totals(), (work, slacking))
+        self.assertEqual(copy.totals(),
+                         (work + datetime.timedelta(hours=1), slacking))
+        self.assertEqual(copy.work['email'][2] - self.aggregates.work['email'][2],
+                         datetime.timedelta(hours=1))
+
+    def test_merge(self):
+        copy = self.aggregates.copy()
+        copy.merge(make_time_window().aggregate())
+        self.assertEqual(vars(copy), vars(self.aggregates))
+
+    def test_from_items(self):
+        aggregates = Aggregates.from_items(iter(self.tw.items),
+                                           self.tw.virtual_midnight)
+        self.assertEqual(vars(aggregates), vars(self.aggregates))
+
+
 class TestTotals(unittest.TestCase):
 
     TEST_TIMELOG = textwrap.dedent(
@@ -1505,6 +3221,12 @@ class TestTagging(unittest.TestCase):
         )
         self.assertEqual(slack, datetime.timedelta(0))
 
+    def test_TimeWindow_totals_by_tag(self):
+        result = self.tw.totals_by_tag()
+        self.assertEqual(set(result), self.tw.set_of_all_tags())
+        for tag, totals in result.items():
+            self.assertEqual(totals, self.tw.totals(tag))
+
     def test_TimeWindow__split_entry_and_tags1(self):
         """Test `TimeWindow._split_entry_and_tags` with simple entry"""
         result = self.tw._split_entry_and_tags('email')
@@ -1540,6 +3262,16 @@ class TestTagging(unittest.TestCase):
         self.assertEqual(result[0], 'read news ***')
         self.assertEqual(result[1], {'reading'})
 
+    def test_TimeWindow__split_entry_and_tags_is_memoized(self):
+        """Test `TimeWindow._split_entry_and_tags` memoizes results"""
+        hits = TimeCollection._split_entry_and_tags.cache_info().hits
+        result = self.tw._split_entry_and_tags('read more news -- reading **')
+        self.assertIsInstance(result[1], frozenset)
+        self.assertIs(self.tw._split_entry_and_tags('read more news -- reading **'),
+                      result)
+        self.assertEqual(TimeCollection._split_entry_and_tags.cache_info().hits,
+                         hits + 1)
+
     def test_Reports__report_tags(self):
         rp = Reports(self.tw)
         txt = StringIO()
@@ -1585,6 +3317,121 @@ class TestTagging(unittest.TestCase):
         self.assertIn('Time spent in each area', txt.getvalue())
 
 
+class TestWriteReports(unittest.TestCase):
+
+    TEST_TIMELOG = textwrap.dedent("""\
+        2014-05-27 10:03: arrived
+        2014-05-27 10:13: edx: introduce topic to new sysadmins -- edx
+        2014-05-27 10:30: email
+        2014-05-27 12:11: meeting: how to support new courses?
+        2014-05-27 15:12: edx: write test procedure for EdX instances -- edx sysadmin
+        2014-05-27 17:03: cyber: testing
+        2014-05-27 17:53: cyber: design
+        2014-05-27 20:53: cyber: design
+        2014-05-28 00:30: lunch **
+
+        2014-05-28 09:00: arrived
+        2014-05-28 10:00: email
+        2014-05-28 12:00: cyber: testing -- bug
+
+        2014-06-02 09:00: arrived
+        2014-06-02 12:00: cyber: design
+        2014-06-02 13:00: lunch **
+        2014-06-02 13:30: misc ***
+    """)
+
+    periods = [
+        (ReportRecord.MONTHLY, datetime.date(2014, 5, 1)),
+        (ReportRecord.WEEKLY, datetime.date(2014, 5, 27)),
+        (ReportRecord.DAILY, datetime.date(2014, 5, 27)),
+        (ReportRecord.DAILY, datetime.date(2014, 5, 28)),
+        (ReportRecord.DAILY, datetime.date(2014, 5, 29)),
+        (ReportRecord.WEEKLY, datetime.date(2014, 6, 2)),
+        (ReportRecord.MONTHLY, datetime.date(2014, 6, 1)),
+        (ReportRecord.MONTHLY, datetime.date(2014, 7, 1)),
+    ]
+
+    def setUp(self):
+        self.timelog = TimeLog(StringIO(self.TEST_TIMELOG), datetime.time(2, 0))
+
+    def report(self, report_kind, date, style):
+        window = {
+            ReportRecord.DAILY: self.timelog.window_for_day,
+            ReportRecord.WEEKLY: self.timelog.window_for_week,
+            ReportRecord.MONTHLY: self.timelog.window_for_month,
+        }[report_kind](date)
+        # bypass cached aggregates
+        window = window.window_for(window.min_timestamp, window.max_timestamp)
+        reports = Reports(window, style=style)
+        output = StringIO()
+        getattr(reports, report_kind + '_report')(output, 'foo@bar.com',
+                                                  'Bob')
+        return output.getvalue()
+
+    def test_write_reports(self):
+        for style in ['plain', 'categorized']:
+            outputs = []
+
+            def output_for(report_kind, date):
+                outputs.append((report_kind, date, StringIO()))
+                return outputs[-1][-1]
+
+            write_reports(self.timelog, self.periods, output_for,
+                          'foo@bar.com', 'Bob', style=style)
+            self.assertEqual([(report_kind, date)
+                              for report_kind, date, output in outputs],
+                             self.periods)
+            for report_kind, date, output in outputs:
+                self.assertEqual(output.getvalue(),
+                                 self.report(report_kind, date, style))
+
+    def assertSameInProcesses(self):
+        serial = {}
+        write_reports(self.timelog, self.periods,
+                      lambda report_kind, date: serial.setdefault(
+                          (report_kind, date), StringIO()),
+                      'foo@bar.com', 'Bob', style='categorized')
+        # threads let coverage see the code that runs in worker processes
+        for executor in [concurrent.futures.ProcessPoolExecutor,
+                         concurrent.futures.ThreadPoolExecutor]:
+            outputs = {}
+            with mock.patch('concurrent.futures.ProcessPoolExecutor',
+                            executor):
+                write_reports(self.timelog, self.periods,
+                              lambda report_kind, date: outputs.setdefault(
+                                  (report_kind, date), StringIO()),
+                              'foo@bar.com', 'Bob', style='categorized',
+                              processes=2)
+            self.assertEqual(list(outputs), self.periods)
+            self.assertEqual(
+                [output.getvalue() for output in outputs.values()],
+                [output.getvalue() for output in serial.values()])
+
+    def test_write_reports_in_processes(self):
+        self.assertSameInProcesses()
+
+    def test_write_reports_in_processes_keeps_seconds(self):
+        self.timelog.items = list(self.timelog.items) + [
+            (datetime.datetime(2014, 6, 3, 9, 0, 30), 'arrived'),
+            (datetime.datetime(2014, 6, 3, 9, 1, 10), 'work'),
+            (datetime.datetime(2014, 6, 3, 9, 3, 50), 'lunch **'),
+        ]
+        self.assertSameInProcesses()
+
+    def test_write_reports_reuses_cached_aggregates(self):
+        window = self.timelog.window_for_week(datetime.date(2014, 5, 27))
+        aggregates = window.aggregate()
+        write_reports(self.timelog, iter(self.periods),
+                      lambda report_kind, date: StringIO(),
+                      'foo@bar.com', 'Bob')
+        self.assertIs(window.aggregate(), aggregates)
+
+    def test_write_reports_no_periods(self):
+        output_for = mock.Mock()
+        write_reports(self.timelog, [], output_for, 'foo@bar.com', 'Bob')
+        output_for.assert_not_called()
+
+
 class TestReportRecord(Mixins, unittest.TestCase):
 
     def setUp(self):
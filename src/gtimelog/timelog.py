@@ -3,12 +3,23 @@ Non-GUI bits of gtimelog.
 """
 
 import collections
+import collections.abc
+import concurrent.futures
+import copy
 import csv
 import datetime
+import functools
+import io
+import mmap
 import os
 import re
+import shutil
 import socket
+import struct
 import sys
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
 from collections import defaultdict
 from hashlib import md5
 from operator import itemgetter
@@ -62,6 +73,79 @@ def parse_datetime(dt):
     return datetime.datetime(year, month, day, hour, min)
 
 
+# datetime.datetime(1, 1, 1).toordinal() == 1
+MINUTES_EPOCH = datetime.datetime(1, 1, 1)
+
+
+def datetime_to_minutes(dt):
+    """Convert a datetime.datetime to an integer number of minutes.
+
+    The minutes are counted from 0001-01-01 00:00.
+    """
+    return (dt.toordinal() - 1) * 1440 + dt.hour * 60 + dt.minute
+
+
+def minutes_to_datetime(minutes):
+    """Convert a number of minutes back to a datetime.datetime."""
+    return MINUTES_EPOCH + datetime.timedelta(minutes=minutes)
+
+
+def minutes_to_datetimes(column):
+    """Convert a sequence of minute counts to datetime.datetime objects.
+
+    Returns an iterator.  This is faster than calling minutes_to_datetime()
+    for each one.
+    """
+    dates = {}
+    for minutes in column:
+        days, minutes = divmod(minutes, 1440)
+        ymd = dates.get(days)
+        if ymd is None:
+            d = datetime.date.fromordinal(days + 1)
+            ymd = dates[days] = (d.year, d.month, d.day)
+        hour, minute = divmod(minutes, 60)
+        yield datetime.datetime(ymd[0], ymd[1], ymd[2], hour, minute)
+
+
+def timestamp_parser():
+    """Return a function that converts a date and a time to minutes.
+
+    The function takes 'YYYY-MM-DD' and 'HH:MM' strings (or bytes) with
+    digits in all the right places, and returns the number of minutes as
+    datetime_to_minutes() does, or -1 if the date or time is not valid.
+
+    Since the same dates and times occur over and over in a time log, it
+    remembers the ones it has seen.
+    """
+    days = {}
+    times = {}
+
+    def parse(date, hhmm):
+        day = days.get(date)
+        if day is None:
+            try:
+                day = datetime.date(
+                    int(date[:4]), int(date[5:7]), int(date[8:])
+                ).toordinal() * 1440 - 1440
+            except ValueError:
+                day = -1
+            days[date] = day
+        time = times.get(hhmm)
+        if time is None:
+            hour = int(hhmm[:2])
+            minute = int(hhmm[3:])
+            if hour < 24 and minute < 60:
+                time = hour * 60 + minute
+            else:
+                time = -1
+            times[hhmm] = time
+        if day < 0 or time < 0:
+            return -1
+        return day + time
+
+    return parse
+
+
 def parse_time(t):
     """Parse a time instance from 'HH:MM' formatted string."""
     m = re.match(r'^(\d+):(\d+)$', t)
@@ -136,13 +220,252 @@ def get_mtime(filename):
         return None
 
 
+def get_mtime_and_size(filename):
+    """Return the modification time and size of a file, if it exists.
+
+    Returns (None, None) if the file doesn't exist.
+    """
+    if hasattr(filename, 'read'):
+        return None, None
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None, None
+    return st.st_mtime, st.st_size
+
+
+def fsync_dir(dirname):
+    """Make sure that renames in a directory survive a crash.
+
+    Does nothing where directories can't be opened (e.g. on Windows).
+    """
+    try:
+        fd = os.open(dirname, os.O_RDONLY)
+    except OSError:  # pragma: nocover
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
 Entry = collections.namedtuple('Entry', 'start stop duration tags entry')
 
 
+class ItemSlice(collections.abc.Sequence):
+    """A read-only view of a slice of a sorted list of items.
+
+    Behaves like the list ``items[start:stop]`` but doesn't copy it.
+
+    ``timestamps`` is a list parallel to ``items`` that holds just the
+    timestamps, for binary searches.
+
+    The underlying lists may grow at the end (that doesn't affect the
+    view), but must not be modified otherwise.
+    """
+
+    __slots__ = ('_items', '_timestamps', 'start', 'stop')
+
+    def __init__(self, items, timestamps, start=0, stop=None):
+        self._items = items
+        self._timestamps = timestamps
+        self.start = start
+        self.stop = len(items) if stop is None else stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return ItemSlice(self._items, self._timestamps,
+                             self.start + start,
+                             self.start + max(start, stop))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('index out of range')
+        return self._items[self.start + index]
+
+    def __iter__(self):
+        return map(self._items.__getitem__, range(self.start, self.stop))
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, ItemSlice)):
+            return NotImplemented
+        return len(self) == len(other) and list(self) == list(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def between(self, min_timestamp, max_timestamp):
+        """Return an ItemSlice of items in a time interval.
+
+        The interval is half-open (inclusive at ``min_timestamp``, exclusive
+        at ``max_timestamp``).
+        """
+        start = bisect_left(self._timestamps, min_timestamp,
+                            self.start, self.stop)
+        stop = bisect_left(self._timestamps, max_timestamp,
+                           start, self.stop)
+        return ItemSlice(self._items, self._timestamps, start, stop)
+
+
+class CompactItems(collections.abc.MutableSequence):
+    """A memory-efficient list of (timestamp, entry) items.
+
+    Timestamps are stored as an array of minutes (see datetime_to_minutes),
+    so seconds are lost.  Entries are stored as indexes into a table of
+    unique strings, since most entries repeat.  Item tuples are built on
+    demand.
+
+    Entries can also be left undecoded in a buffer (such as a memory-mapped
+    file) until they're needed; see from_buffer().  Negative entry ids
+    refer to such entries.
+    """
+
+    def __init__(self, items=()):
+        self.minutes = array('q')
+        self.entry_ids = array('i')
+        self.strings = []
+        self._string_ids = {}
+        self.buffer = None
+        self.ranges = array('q')
+        self.extend(items)
+
+    @classmethod
+    def from_columns(cls, minutes, entries):
+        """Build from a sequence of minute counts and a sequence of entries."""
+        items = cls()
+        items.minutes.extend(minutes)
+        items.entry_ids.extend(map(items._intern, entries))
+        return items
+
+    def _intern(self, entry):
+        entry_id = self._string_ids.get(entry)
+        if entry_id is None:
+            entry_id = self._string_ids[entry] = len(self.strings)
+            self.strings.append(entry)
+        return entry_id
+
+    @classmethod
+    def from_buffer(cls, buffer, minutes, ranges):
+        """Build from a sequence of minute counts and entries in a buffer.
+
+        ``ranges`` is a flat sequence of (start, stop) byte offsets of each
+        entry in ``buffer``.  Entries are decoded from UTF-8 and stripped
+        when they're first accessed.
+        """
+        items = cls()
+        items.buffer = buffer
+        items.minutes.extend(minutes)
+        items.ranges.extend(ranges)
+        items.entry_ids.extend(range(-1, -1 - len(items.minutes), -1))
+        return items
+
+    def _entry(self, index):
+        entry_id = self.entry_ids[index]
+        if entry_id < 0:
+            n = -2 - 2 * entry_id
+            raw = self.buffer[self.ranges[n]:self.ranges[n + 1]]
+            entry_id = self.entry_ids[index] = self._intern(
+                raw.decode('utf-8').strip())
+        return self.strings[entry_id]
+
+    @property
+    def timestamps(self):
+        """A read-only sequence of timestamps, for binary searches."""
+        return Timestamps(self.minutes)
+
+    def __len__(self):
+        return len(self.minutes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return (minutes_to_datetime(self.minutes[index]),
+                self._entry(index))
+
+    def __setitem__(self, index, item):
+        if isinstance(index, slice):
+            raise TypeError('slice assignment is not supported')
+        time, entry = item
+        self.minutes[index] = datetime_to_minutes(time)
+        self.entry_ids[index] = self._intern(entry)
+
+    def __delitem__(self, index):
+        del self.minutes[index]
+        del self.entry_ids[index]
+
+    def insert(self, index, item):
+        time, entry = item
+        self.minutes.insert(index, datetime_to_minutes(time))
+        self.entry_ids.insert(index, self._intern(entry))
+
+    def append(self, item):
+        time, entry = item
+        self.minutes.append(datetime_to_minutes(time))
+        self.entry_ids.append(self._intern(entry))
+
+    def extend(self, items):
+        items = list(items)
+        self.minutes.extend([datetime_to_minutes(time) for time, entry in items])
+        self.entry_ids.extend([self._intern(entry) for time, entry in items])
+
+    def __iter__(self):
+        if self.ranges:
+            entries = map(self._entry, range(len(self)))
+        else:
+            entries = map(self.strings.__getitem__, self.entry_ids)
+        return zip(minutes_to_datetimes(self.minutes), entries)
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, ItemSlice, CompactItems)):
+            return NotImplemented
+        return len(self) == len(other) and list(self) == list(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def copy(self):
+        """Return a copy that can be modified independently."""
+        new = CompactItems()
+        new.minutes = array('q', self.minutes)
+        new.entry_ids = array('i', self.entry_ids)
+        new.strings = list(self.strings)
+        new._string_ids = dict(self._string_ids)
+        new.buffer = self.buffer
+        new.ranges = self.ranges
+        return new
+
+
+class Timestamps(collections.abc.Sequence):
+    """A read-only view of an array of minutes as datetime.datetime objects."""
+
+    __slots__ = ('minutes', )
+
+    def __init__(self, minutes):
+        self.minutes = minutes
+
+    def __len__(self):
+        return len(self.minutes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(minutes_to_datetimes(self.minutes[index]))
+        return minutes_to_datetime(self.minutes[index])
+
+
 class TimeCollection(object):
     """A collection of timestamped events.
 
-    self.items is a list of (timestamp, event_title) tuples.
+    self.items is a sequence of (timestamp, event_title) tuples.
 
     Time intervals between events within the time window form entries that have
     a start time, a stop time, and a duration.  Entry title is the title of the
@@ -156,9 +479,29 @@ class TimeCollection(object):
     """
 
     def __init__(self, virtual_midnight):
+        self.version = 0
+        self._aggregates = None
+        self._day_ordinals = None
         self.items = []
         self.virtual_midnight = virtual_midnight
 
+    @property
+    def items(self):
+        return self._items
+
+    @items.setter
+    def items(self, items):
+        self._items = items
+        self.changed()
+
+    def changed(self):
+        """Note that items were changed.
+
+        This invalidates cached derived data.  Assigning to self.items
+        calls this automatically; in-place changes must call it explicitly.
+        """
+        self.version += 1
+
     def last_time(self):
         """Return the time of the last entry.
 
@@ -181,16 +524,32 @@ class TimeCollection(object):
             return None
         stop = self.items[-1][0]
         entry = self.items[-1][1]
-        if len(self.items) == 1:
+        days = self.day_ordinals()
+        if len(self.items) == 1 or days[-2] != days[-1]:
             start = stop
         else:
             start = self.items[-2][0]
-        if different_days(start, stop, self.virtual_midnight):
-            start = stop
         duration = stop - start
         entry, tags = self._split_entry_and_tags(entry)
         return Entry(start, stop, duration, tags, entry)
 
+    def items_between(self, min_timestamp, max_timestamp):
+        """Return a list of items in a time interval.
+
+        The interval is half-open (inclusive at ``min_timestamp``, exclusive
+        at ``max_timestamp``).
+        """
+        return [item for item in self.items
+                if min_timestamp <= item[0] < max_timestamp]
+
+    def window_for(self, min, max):
+        """Return a TimeWindow for a specified time interval.
+
+        ``min`` and ``max`` should be datetime.datetime instances.  The
+        interval is half-open (inclusive at ``min``, exclusive at ``max``).
+        """
+        return TimeWindow(self, min, max)
+
     def all_entries(self):
         """Iterate over all entries.
 
@@ -198,18 +557,39 @@ class TimeCollection(object):
         of 0.
         """
         stop = None
-        for item in self.items:
+        last_day = None
+        for item, day in zip(self.items, self.day_ordinals()):
             start = stop
             stop = item[0]
             entry = item[1]
-            if start is None or different_days(start, stop,
-                                               self.virtual_midnight):
+            if day != last_day:
                 start = stop
+                last_day = day
             duration = stop - start
             entry, tags = self._split_entry_and_tags(entry)
             yield Entry(start, stop, duration, tags, entry)
 
+    def day_ordinals(self):
+        """Return the ordinals of the virtual days of all items.
+
+        This is a sequence parallel to self.items, so checking whether two
+        items happened on the same virtual day is an integer comparison.
+
+        The result is cached until the items or virtual midnight change.
+        Do not modify it.
+        """
+        key = self._cache_key()
+        if self._day_ordinals is None or self._day_ordinals[0] != key:
+            self._day_ordinals = (key, self._compute_day_ordinals())
+        return self._day_ordinals[1]
+
+    def _compute_day_ordinals(self):
+        vm = self.virtual_midnight
+        return array('i', [virtual_day(item[0], vm).toordinal()
+                           for item in self.items])
+
     @staticmethod
+    @functools.lru_cache(maxsize=8192)
     def _split_entry_and_tags(entry):
         """
         Split the entry title (proper) from the trailing tags.
@@ -218,7 +598,11 @@ class TimeCollection(object):
         anything *before* the marker is the entry title,
         anything *following* it is the (space-separated) set of tags.
 
-        Returns a tuple consisting of entry title and set of tags.
+        Returns a tuple consisting of entry title and frozenset of tags.
+
+        Results are memoized, since the same entries recur over and over;
+        use ``TimeCollection._split_entry_and_tags.cache_info()`` to see
+        how well that works.
         """
         if ' -- ' in entry:
             entry, tags_bundle = entry.split(' -- ', 1)
@@ -232,8 +616,9 @@ class TimeCollection(object):
             elif '**' in tags:
                 entry += ' **'
                 tags.remove('**')
+            tags = frozenset(tags)
         else:
-            tags = set()
+            tags = frozenset()
         return entry, tags
 
     @staticmethod
@@ -250,23 +635,72 @@ class TimeCollection(object):
         else:
             return None, entry
 
+    def aggregate(self):
+        """Compute Aggregates of all entries in a single pass.
+
+        The result is cached until the items or virtual midnight change.
+        Do not modify it.
+        """
+        key = self._cache_key()
+        if self._aggregates is None or self._aggregates[0] != key:
+            self._aggregates = (key, self._aggregate())
+        return self._aggregates[1]
+
+    def _aggregate(self):
+        return Aggregates(self)
+
+    def _cached_aggregates(self):
+        """Return the cached Aggregates, if they are up to date."""
+        if (self._aggregates is not None
+                and self._aggregates[0] == self._cache_key()):
+            return self._aggregates[1]
+        return None
+
+    def _cache_key(self):
+        """Return the key of cached data derived from items.
+
+        Besides the version, this includes the number of items, in case
+        they were changed in place without calling changed().
+        """
+        return (self.version, self.virtual_midnight, len(self.items))
+
+    def daily_totals(self):
+        """Compute the time spent on each calendar date.
+
+        Returns a dict mapping dates to [day_start, slacking, work] lists of
+        timedeltas, where day_start is the time of the first entry of that
+        date.  Entries count towards the date they start on.
+        """
+        totals = {}
+        for entry in self.all_entries():
+            self._add_daily_total(totals, entry)
+        return totals
+
+    @staticmethod
+    def _add_daily_total(totals, entry):
+        start, stop, duration, tags, title = entry
+        d0 = datetime.timedelta(0)
+        day = totals.get(start.date())
+        if day is None:
+            day = totals[start.date()] = [
+                datetime.timedelta(minutes=start.minute, hours=start.hour),
+                d0, d0]
+        if '**' in title:
+            day[1] += duration
+        else:
+            day[2] += duration
+
+    def _rollup_for(self, window):
+        """Return a DayRollup that can aggregate a window, or None."""
+        return None
+
     def set_of_all_tags(self):
         """Return the set of all tags mentioned in entries."""
-        all_tags = set()
-        for entry in self.all_entries():
-            all_tags.update(entry.tags)
-        return all_tags
+        return set(self.aggregate().tags)
 
     def count_days(self):
         """Count days that have entries."""
-        count = 0
-        last = None
-        for entry in self.all_entries():
-            if last is None or different_days(last, entry.start,
-                                              self.virtual_midnight):
-                last = entry.start
-                count += 1
-        return count
+        return self.aggregate().days
 
     def grouped_entries(self, skip_first=True,
                         sorted_by='start-time', sorted_tasks=None):
@@ -276,29 +710,9 @@ class TimeCollection(object):
         entries are identified by finding two asterisks in the title.
         Entry lists are sorted, and contain (start, entry, duration) tuples.
         """
-        work = {}
-        slack = {}
-        for start, stop, duration, tags, entry in self.all_entries():
-            if skip_first:
-                # XXX: in case of for multi-day windows, this should skip
-                # the 1st entry of each day
-                skip_first = False
-                continue
-            if '***' in entry:
-                continue
-            if '**' in entry:
-                entries = slack
-            else:
-                entries = work
-            if entry in entries:
-                old_start, old_entry, old_duration = entries[entry]
-                start = min(start, old_start)
-                duration += old_duration
-            entries[entry] = (start, entry, duration)
-        key_func = self._get_grouped_order_key(sorted_by, sorted_tasks)
-        work = sorted(work.values(), key=key_func)
-        slack = sorted(slack.values(), key=key_func)
-        return work, slack
+        return self.aggregate().grouped_entries(
+            skip_first=skip_first, sorted_by=sorted_by,
+            sorted_tasks=sorted_tasks)
 
     def categorized_work_entries(self, skip_first=True):
         """Return consolidated work entries grouped by category.
@@ -312,17 +726,7 @@ class TimeCollection(object):
           - {<category>: <total duration>}, where <total duration> is the
             total duration of work in the <category>.
         """
-
-        work, slack = self.grouped_entries(skip_first=skip_first)
-        entries = {}
-        totals = {}
-        for start, entry, duration in work:
-            cat, task = self.split_category(entry)
-            entry_list = entries.get(cat, [])
-            entry_list.append((start, task, duration))
-            entries[cat] = entry_list
-            totals[cat] = totals.get(cat, datetime.timedelta(0)) + duration
-        return entries, totals
+        return self.aggregate().categorized_work_entries(skip_first=skip_first)
 
     def totals(self, tag=None, filter_text=None):
         """Calculate total time of work and slacking entries.
@@ -350,11 +754,13 @@ class TimeCollection(object):
 
         (that is, it would be true if sum could operate on timedeltas).
         """
+        if filter_text is None:
+            return self.aggregate().totals(tag)
         total_work = total_slacking = datetime.timedelta(0)
         for start, stop, duration, tags, entry in self.all_entries():
             if tag is not None and tag not in tags:
                 continue
-            if filter_text is not None and filter_text not in entry:
+            if filter_text not in entry:
                 continue
             if '***' in entry:
                 continue
@@ -364,6 +770,17 @@ class TimeCollection(object):
                 total_work += duration
         return total_work, total_slacking
 
+    def totals_by_tag(self):
+        """Calculate total time of work and slacking entries for each tag.
+
+        Returns a dict mapping all tags mentioned in entries to
+        (total_work, total_slacking) tuples.
+
+        All tags are added up in the same single pass as everything else in
+        aggregate().
+        """
+        return self.aggregate().totals_by_tag()
+
     @classmethod
     def _get_grouped_order_key(cls, sorted_by, sorted_tasks):
         """
@@ -385,25 +802,296 @@ class TimeCollection(object):
             return lambda x: (sorted_tasks.order(x[1]), x[1])
 
 
+class Aggregates(object):
+    """Aggregated information about entries of a TimeCollection.
+
+    Everything is computed in a single pass over all_entries():
+
+    - ``first_entry`` is the first Entry (or None if there are no entries)
+    - ``total_work`` and ``total_slacking`` are the total durations of work
+      and slacking entries
+    - ``work`` and ``slack`` are dicts mapping entry titles to consolidated
+      (start, entry, duration) tuples, skipping the first entry
+    - ``tags`` is the set of all tags mentioned in entries
+    - ``tag_totals`` is a dict mapping tags to (work, slacking) tuples of
+      total durations of entries with that tag
+    - ``days`` is the number of days that have entries
+
+    Use from_items() to aggregate items without having all of them in
+    memory at once.
+    """
+
+    def __init__(self, collection):
+        self._reset(collection.virtual_midnight)
+        for entry, day in zip(collection.all_entries(),
+                              collection.day_ordinals()):
+            self.add(entry, day)
+
+    @classmethod
+    def from_items(cls, items, virtual_midnight):
+        """Compute Aggregates from an iterable of (timestamp, title) items.
+
+        The items must be sorted.  They're consumed one by one, so memory
+        use depends on the number of distinct entry titles and tags, not on
+        the number of items.
+        """
+        self = cls.__new__(cls)
+        self._reset(virtual_midnight)
+        stop = None
+        last_day = None
+        split = TimeCollection._split_entry_and_tags
+        for time, title in items:
+            start = stop
+            stop = time
+            day = virtual_day(time, virtual_midnight).toordinal()
+            if day != last_day:
+                start = stop
+                last_day = day
+            title, tags = split(title)
+            self.add(Entry(start, stop, stop - start, tags, title), day)
+        return self
+
+    def _reset(self, virtual_midnight):
+        self.virtual_midnight = virtual_midnight
+        self.first_entry = None
+        self.total_work = self.total_slacking = datetime.timedelta(0)
+        self.work = {}
+        self.slack = {}
+        self.tags = set()
+        self.tag_totals = {}
+        self.days = 0
+        self._day = None
+
+    def add(self, entry, day=None):
+        """Account for one more entry.
+
+        ``day`` is the ordinal of its virtual day, if known.
+        """
+        start, stop, duration, tags, title = entry
+        if day is None:
+            day = virtual_day(start, self.virtual_midnight).toordinal()
+        if day != self._day:
+            self._day = day
+            self.days += 1
+        self.tags.update(tags)
+        if self.first_entry is None:
+            # XXX: in case of for multi-day windows, grouped_entries() should
+            # skip the 1st entry of each day
+            self.first_entry = entry
+        elif '***' not in title:
+            self._group(entry)
+        if '***' in title:
+            return
+        zero = datetime.timedelta(0)
+        if '**' in title:
+            self.total_slacking += duration
+            for tag in tags:
+                work, slacking = self.tag_totals.get(tag, (zero, zero))
+                self.tag_totals[tag] = (work, slacking + duration)
+        else:
+            self.total_work += duration
+            for tag in tags:
+                work, slacking = self.tag_totals.get(tag, (zero, zero))
+                self.tag_totals[tag] = (work + duration, slacking)
+
+    def merge(self, other):
+        """Account for all entries aggregated by ``other``.
+
+        ``other`` must aggregate entries of later virtual days than any of
+        the ones aggregated so far.
+        """
+        first = other.first_entry
+        if first is None:
+            return
+        if self.first_entry is None:
+            self.first_entry = first
+        elif '***' not in first.entry:
+            self._group(first)
+        for entries, more in ((self.work, other.work),
+                              (self.slack, other.slack)):
+            for title, (start, title, duration) in more.items():
+                if title in entries:
+                    old_start, old_title, old_duration = entries[title]
+                    start = min(start, old_start)
+                    duration += old_duration
+                entries[title] = (start, title, duration)
+        self.total_work += other.total_work
+        self.total_slacking += other.total_slacking
+        self.tags.update(other.tags)
+        zero = datetime.timedelta(0)
+        for tag, (work, slacking) in other.tag_totals.items():
+            old_work, old_slacking = self.tag_totals.get(tag, (zero, zero))
+            self.tag_totals[tag] = (old_work + work, old_slacking + slacking)
+        self.days += other.days
+        self._day = other._day
+
+    def copy(self):
+        """Return a copy that can be updated independently."""
+        new = copy.copy(self)
+        new.work = dict(self.work)
+        new.slack = dict(self.slack)
+        new.tags = set(self.tags)
+        new.tag_totals = dict(self.tag_totals)
+        return new
+
+    def _group(self, entry, work=None, slack=None):
+        start, stop, duration, tags, title = entry
+        if '**' in title:
+            entries = self.slack if slack is None else slack
+        else:
+            entries = self.work if work is None else work
+        if title in entries:
+            old_start, old_entry, old_duration = entries[title]
+            start = min(start, old_start)
+            duration += old_duration
+        entries[title] = (start, title, duration)
+
+    def totals(self, tag=None):
+        """Return total time of work and slacking entries.
+
+        If optional argument `tag` is given, only count entries marked with
+        the given tag.
+
+        Returns (total_work, total_slacking) tuple.
+        """
+        if tag is None:
+            return self.total_work, self.total_slacking
+        zero = datetime.timedelta(0)
+        return self.tag_totals.get(tag, (zero, zero))
+
+    def totals_by_tag(self):
+        """Return total time of work and slacking entries for each tag.
+
+        Returns a dict mapping all tags to (total_work, total_slacking)
+        tuples.
+        """
+        zero = datetime.timedelta(0)
+        return {tag: self.tag_totals.get(tag, (zero, zero))
+                for tag in self.tags}
+
+    def grouped_entries(self, skip_first=True,
+                        sorted_by='start-time', sorted_tasks=None):
+        """Return consolidated entries (grouped by entry title).
+
+        See TimeCollection.grouped_entries().
+        """
+        work, slack = self.work, self.slack
+        first = self.first_entry
+        if not skip_first and first is not None and '***' not in first.entry:
+            work, slack = dict(work), dict(slack)
+            self._group(first, work, slack)
+        key_func = TimeCollection._get_grouped_order_key(sorted_by,
+                                                         sorted_tasks)
+        work = sorted(work.values(), key=key_func)
+        slack = sorted(slack.values(), key=key_func)
+        return work, slack
+
+    def categorized_work_entries(self, skip_first=True):
+        """Return consolidated work entries grouped by category.
+
+        See TimeCollection.categorized_work_entries().
+        """
+        work, slack = self.grouped_entries(skip_first=skip_first)
+        entries = {}
+        totals = {}
+        for start, entry, duration in work:
+            cat, task = TimeCollection.split_category(entry)
+            entry_list = entries.get(cat, [])
+            entry_list.append((start, task, duration))
+            entries[cat] = entry_list
+            totals[cat] = totals.get(cat, datetime.timedelta(0)) + duration
+        return entries, totals
+
+
+class StreamedWindow(object):
+    """Aggregated entries of a time interval, without the entries themselves.
+
+    ``items`` is an iterable of sorted (timestamp, title) tuples between
+    min_timestamp and max_timestamp.  It's consumed once, by Aggregates.
+
+    This has just enough of the TimeWindow interface for Reports.
+    """
+
+    def __init__(self, items, min_timestamp, max_timestamp, virtual_midnight):
+        self.min_timestamp = min_timestamp
+        self.max_timestamp = max_timestamp
+        self.virtual_midnight = virtual_midnight
+        self._aggregates = Aggregates.from_items(items, virtual_midnight)
+
+    def aggregate(self):
+        """Return Aggregates of all entries."""
+        return self._aggregates
+
+
 class TimeWindow(TimeCollection):
     """A window into a time log.
 
     Includes all events that took place between min_timestamp and
     max_timestamp.  Includes events that took place at min_timestamp, but
     excludes events that took place at max_timestamp.
+
+    Windows into a TimeLog (and windows into those windows) don't copy the
+    items, they are ItemSlice views of TimeLog.items.
     """
 
-    def __init__(self, original, min_timestamp, max_timestamp):
+    def __init__(self, original, min_timestamp, max_timestamp, items=None):
         super(TimeWindow, self).__init__(original.virtual_midnight)
+        self.original = original
         self.min_timestamp = min_timestamp
         self.max_timestamp = max_timestamp
-        self.items = [item for item in original.items
-                      if min_timestamp <= item[0] < max_timestamp]
+        if items is None:
+            items = original.items_between(min_timestamp, max_timestamp)
+        self.items = items
+
+    def _compute_day_ordinals(self):
+        # if our items are a view of the original's, so are the ordinals
+        items = self.items
+        original = self.original
+        source = original.items
+        if isinstance(source, ItemSlice):
+            base, offset, limit = source._items, source.start, source.stop
+        else:
+            base, offset, limit = source, 0, len(source)
+        if (isinstance(items, ItemSlice) and items._items is base
+                and offset <= items.start and items.stop <= limit
+                and original.virtual_midnight == self.virtual_midnight):
+            days = original.day_ordinals()
+            return days[items.start - offset:items.stop - offset]
+        return super(TimeWindow, self)._compute_day_ordinals()
 
     def __repr__(self):
         return '<TimeWindow: {}..{}>'.format(self.min_timestamp,
                                              self.max_timestamp)
 
+    def _aggregate(self):
+        rollup = self.original._rollup_for(self)
+        if rollup is not None:
+            return rollup.aggregate(self.min_timestamp.date(),
+                                    self.max_timestamp.date())
+        return super(TimeWindow, self)._aggregate()
+
+    def daily_totals(self):
+        """Compute the time spent on each calendar date.
+
+        See TimeCollection.daily_totals().
+        """
+        rollup = self.original._rollup_for(self)
+        if rollup is not None:
+            return rollup.daily_totals(self.min_timestamp.date(),
+                                       self.max_timestamp.date())
+        return super(TimeWindow, self).daily_totals()
+
+    def items_between(self, min_timestamp, max_timestamp):
+        """Return a sequence of items in a time interval.
+
+        The interval is half-open (inclusive at ``min_timestamp``, exclusive
+        at ``max_timestamp``).
+        """
+        if isinstance(self.items, ItemSlice):
+            return self.items.between(min_timestamp, max_timestamp)
+        return super(TimeWindow, self).items_between(min_timestamp,
+                                                     max_timestamp)
+
 
 class Exports(object):
     """Exporting of events."""
@@ -464,23 +1152,11 @@ class Exports(object):
         # timelog must be chronological for this to be dependable
 
         d0 = datetime.timedelta(0)
-        days = {} # date -> [time_started, slacking, work]
-        dmin = None
-        for start, stop, duration, tags, entry in self.window.all_entries():
-            if dmin is None:
-                dmin = start.date()
-            day = days.setdefault(start.date(),
-                                  [datetime.timedelta(minutes=start.minute,
-                                                      hours=start.hour),
-                                   d0, d0])
-            if '**' in entry:
-                day[1] += duration
-            else:
-                day[2] += duration
-
-        if dmin:
+        days = self.window.daily_totals() # date -> [started, slacking, work]
+        if days:
             # fill in missing dates - aka. weekends
-            dmax = start.date()
+            dmin = min(days)
+            dmax = max(days)
             while dmin <= dmax:
                 days.setdefault(dmin, [d0, d0, d0])
                 dmin += datetime.timedelta(days=1)
@@ -493,7 +1169,11 @@ class Exports(object):
 
 
 class Reports(object):
-    """Generation of reports."""
+    """Generation of reports.
+
+    ``window`` can be a TimeWindow or, to avoid keeping all the entries of
+    a long period in memory, a StreamedWindow.
+    """
 
     def __init__(self, window, email_headers=True, style='plain'):
         self.window = window
@@ -540,15 +1220,15 @@ class Reports(object):
             output.write("Subject: %s\n" % subject)
             output.write('\n')
 
-        items = list(window.all_entries())
-        if not items:
+        aggregates = window.aggregate()
+        if aggregates.first_entry is None:
             output.write("No work done this %s.\n" % period_name)
             return
         output.write(" " * 46)
         output.write("                   time\n")
 
-        total_work, total_slacking = window.totals()
-        entries, totals = window.categorized_work_entries()
+        total_work, total_slacking = aggregates.totals()
+        entries, totals = aggregates.categorized_work_entries()
         if entries:
             if None in entries:
                 e = entries.pop(None)
@@ -589,11 +1269,10 @@ class Reports(object):
         for time, cat in ordered_by_time:
             output.write(line_format % (cat, format_duration_short(time)))
 
-        tags = self.window.set_of_all_tags()
-        if tags:
-            self._report_tags(output, tags)
+        if aggregates.tags:
+            self._report_tags(output, aggregates.tags, aggregates)
 
-    def _report_tags(self, output, tags):
+    def _report_tags(self, output, tags, aggregates=None):
         """Helper method that lists time spent per tag.
 
         Use this to add a section in a report looks similar to this:
@@ -606,20 +1285,29 @@ class Reports(object):
         as a single entry can have multiple or no tags at all!
 
         Argument `tags` is a set of tags (string).  It is not modified.
+
+        Argument `aggregates` can be used to pass in precomputed window
+        Aggregates.
         """
         output.write('\n')
         output.write('Time spent in each area:\n')
         output.write('\n')
         # sum work and slacking time per tag; we do not care in this report
+        if aggregates is None:
+            aggregates = self.window.aggregate()
+        totals_by_tag = aggregates.totals_by_tag()
+        zero = datetime.timedelta(0)
         tags_totals = {}
         for tag in tags:
-            spent_working, spent_slacking = self.window.totals(tag)
+            spent_working, spent_slacking = totals_by_tag.get(tag,
+                                                              (zero, zero))
             tags_totals[tag] = spent_working + spent_slacking
         # compute width of tag label column
         max_tag_length = max([len(tag) for tag in tags_totals.keys()])
         line_format = '  %-' + str(max_tag_length + 4) + 's %+5s\n'
-        # sort by time spent (descending)
-        for tag, spent in sorted(tags_totals.items(),
+        # sort by time spent (descending), and ties by name, because set
+        # order is arbitrary
+        for tag, spent in sorted(sorted(tags_totals.items()),
                                  key=(lambda it: it[1]),
                                  reverse=True):
             output.write(line_format % (tag, format_duration_short(spent)))
@@ -665,14 +1353,14 @@ class Reports(object):
             output.write('Subject: %s\n' % subject)
             output.write('\n')
 
-        items = list(window.all_entries())
-        if not items:
+        aggregates = window.aggregate()
+        if aggregates.first_entry is None:
             output.write("No work done this %s.\n" % period_name)
             return
         output.write(" " * 46)
         output.write("                time\n")
-        work, slack = window.grouped_entries()
-        total_work, total_slacking = window.totals()
+        work, slack = aggregates.grouped_entries()
+        total_work, total_slacking = aggregates.totals()
         categories = {}
         if work:
             work = [(entry, duration) for start, entry, duration in work]
@@ -695,9 +1383,8 @@ class Reports(object):
         if categories:
             self._report_categories(output, categories)
 
-        tags = self.window.set_of_all_tags()
-        if tags:
-            self._report_tags(output, tags)
+        if aggregates.tags:
+            self._report_tags(output, aggregates.tags, aggregates)
 
     def weekly_report_subject(self, who):
         week = self.window.min_timestamp.isocalendar()[1]
@@ -776,16 +1463,16 @@ class Reports(object):
             output.write("To: %s\n" % email)
             output.write("Subject: %s\n" % self.daily_report_subject(who))
             output.write('\n')
-        items = list(window.all_entries())
-        if not items:
+        aggregates = window.aggregate()
+        if aggregates.first_entry is None:
             output.write("No work done today.\n")
             return
-        start, stop, duration, tags, entry = items[0]
+        start, stop, duration, tags, entry = aggregates.first_entry
         entry = entry[:1].upper() + entry[1:]
         output.write("%s at %s\n" % (entry, start.strftime('%H:%M')))
         output.write('\n')
-        work, slack = window.grouped_entries()
-        total_work, total_slacking = window.totals()
+        work, slack = aggregates.grouped_entries()
+        total_work, total_slacking = aggregates.totals()
         categories = {}
         if work:
             for start, entry, duration in work:
@@ -813,9 +1500,8 @@ class Reports(object):
         output.write("Time spent slacking: %s\n" %
                      format_duration_long(total_slacking))
 
-        tags = self.window.set_of_all_tags()
-        if tags:
-            self._report_tags(output, tags)
+        if aggregates.tags:
+            self._report_tags(output, aggregates.tags, aggregates)
 
 
 class ReportRecord(object):
@@ -900,63 +1586,726 @@ class ReportRecord(object):
         return self._records.get((report_kind, report_id), [])
 
 
+def write_reports(timelog, periods, output_for, email, who, style='plain',
+                  email_headers=True, processes=None):
+    """Write reports of many periods at once.
+
+    ``periods`` is a sequence of (report_kind, date) tuples, where
+    report_kind is one of ReportRecord.DAILY, WEEKLY, MONTHLY, and date is
+    a date in the report period.
+
+    ``output_for(report_kind, date)`` is called for each period, in order,
+    and should return a file-like object to write the report to.  It's not
+    closed afterwards.
+
+    Instead of aggregating the entries of each period separately, this
+    splits the time log at all period boundaries, aggregates each part in
+    a single pass, and adds up parts.
+
+    If ``processes`` is a number, reports are rendered in a pool of that
+    many worker processes instead, each getting the items of one period in
+    a compact form.  The output is the same.
+    """
+    window_for = {
+        ReportRecord.DAILY: timelog.window_for_day,
+        ReportRecord.WEEKLY: timelog.window_for_week,
+        ReportRecord.MONTHLY: timelog.window_for_month,
+    }
+    periods = list(periods)
+    windows = [window_for[report_kind](date) for report_kind, date in periods]
+    if not windows:
+        return
+    if processes is not None:
+        tasks = [(report_kind, window.min_timestamp, window.max_timestamp,
+                  window.virtual_midnight, _pack_items(window.items),
+                  email, who, style, email_headers)
+                 for (report_kind, date), window in zip(periods, windows)]
+        with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+            for (report_kind, date), text in zip(
+                    periods, executor.map(_render_report, tasks, chunksize=16)):
+                output_for(report_kind, date).write(text)
+        return
+    # all periods start and end at virtual midnight
+    bounds = sorted({w.min_timestamp.date().toordinal() for w in windows}
+                    | {w.max_timestamp.date().toordinal() for w in windows})
+    everything = timelog.window_for(
+        datetime.datetime.combine(datetime.date.fromordinal(bounds[0]),
+                                  timelog.virtual_midnight),
+        datetime.datetime.combine(datetime.date.fromordinal(bounds[-1]),
+                                  timelog.virtual_midnight))
+    parts = [Aggregates.from_items([], timelog.virtual_midnight)
+             for bound in bounds]
+    n = 0
+    for entry, day in zip(everything.all_entries(),
+                          everything.day_ordinals()):
+        while day >= bounds[n + 1]:
+            n += 1
+        parts[n].add(entry, day)
+    for (report_kind, date), window in zip(periods, windows):
+        if window._cached_aggregates() is None:
+            aggregates = Aggregates.from_items([], timelog.virtual_midnight)
+            i = bisect_left(bounds, window.min_timestamp.date().toordinal())
+            j = bisect_left(bounds, window.max_timestamp.date().toordinal())
+            for part in parts[i:j]:
+                aggregates.merge(part)
+            window._aggregates = (window._cache_key(), aggregates)
+        _write_report(window, report_kind, output_for(report_kind, date),
+                      email, who, style, email_headers)
+
+
+def _write_report(window, report_kind, output, email, who, style,
+                  email_headers):
+    reports = Reports(window, email_headers=email_headers, style=style)
+    write_report = getattr(reports, report_kind + '_report')
+    write_report(output, email, who)
+
+
+def _pack_items(items):
+    """Convert items to a compact picklable form.
+
+    Timestamps become microseconds since MINUTES_EPOCH, so unlike in
+    CompactItems, they keep their seconds.
+    """
+    microsecond = datetime.timedelta(microseconds=1)
+    strings = {}
+    times = array('q', [(time - MINUTES_EPOCH) // microsecond
+                        for time, entry in items])
+    entry_ids = array('i', [strings.setdefault(entry, len(strings))
+                            for time, entry in items])
+    return times, entry_ids, list(strings)
+
+
+def _render_report(task):
+    """Render a report in a worker process of write_reports()."""
+    (report_kind, min, max, virtual_midnight, (times, entry_ids, strings),
+     email, who, style, email_headers) = task
+    collection = TimeCollection(virtual_midnight)
+    collection.items = [
+        (MINUTES_EPOCH + datetime.timedelta(microseconds=time), strings[i])
+        for time, i in zip(times, entry_ids)]
+    window = TimeWindow(collection, min, max, collection.items)
+    output = io.StringIO()
+    _write_report(window, report_kind, output, email, who, style,
+                  email_headers)
+    return output.getvalue()
+
+
+class DayIndex(object):
+    """An index of virtual days in a sorted sequence of timestamps.
+
+    Maps virtual days to ranges of item indexes, so finding the items of a
+    day, week or month doesn't need to compare timestamps.
+
+    ``days`` are the ordinals of the virtual days that have items, and
+    ``starts`` the indexes of their first items.
+    """
+
+    def __init__(self, virtual_midnight):
+        self.virtual_midnight = virtual_midnight
+        self.days = array('q')
+        self.starts = array('q')
+        self.length = 0
+
+    def update(self, timestamps):
+        """Index the timestamps that were added at the end since last time."""
+        one_day = datetime.timedelta(1)
+        i = self.length
+        stop = len(timestamps)
+        keys = timestamps
+        if isinstance(timestamps, Timestamps):
+            # compare integer minutes instead of building datetimes
+            keys = timestamps.minutes
+        while i < stop:
+            day = virtual_day(timestamps[i], self.virtual_midnight)
+            ordinal = day.toordinal()
+            if not self.days or self.days[-1] != ordinal:
+                self.days.append(ordinal)
+                self.starts.append(i)
+            next_midnight = datetime.datetime.combine(day + one_day,
+                                                      self.virtual_midnight)
+            if keys is not timestamps:
+                next_midnight = datetime_to_minutes(next_midnight)
+            i = bisect_left(keys, next_midnight, i + 1, stop)
+        self.length = stop
+
+    def slice(self, first_day, last_day):
+        """Return (start, stop) indexes of the items in a range of days.
+
+        The range is half-open (inclusive at ``first_day``, exclusive
+        at ``last_day``).
+        """
+        i = bisect_left(self.days, first_day.toordinal())
+        j = bisect_left(self.days, last_day.toordinal(), i)
+        return self._start(i), self._start(j)
+
+    def _start(self, n):
+        return self.starts[n] if n < len(self.starts) else self.length
+
+
+class DayRollup(object):
+    """Aggregates of each virtual day in a sorted sequence of items.
+
+    Windows that span many days can be aggregated by adding up a row per
+    day instead of going through all their entries.
+
+    ``days`` are the ordinals of the virtual days that have items,
+    ``aggregates`` the Aggregates of their entries, and ``dates`` dicts of
+    their daily_totals().
+    """
+
+    def __init__(self, virtual_midnight):
+        self.virtual_midnight = virtual_midnight
+        self.days = array('q')
+        self.aggregates = []
+        self.dates = []
+        self.length = 0
+        self._stop = None
+
+    def update(self, items, days):
+        """Roll up the items that were added at the end since last time.
+
+        ``days`` are the ordinals of the virtual days of all items (see
+        TimeCollection.day_ordinals()).
+        """
+        split = TimeCollection._split_entry_and_tags
+        add_daily_total = TimeCollection._add_daily_total
+        new_items = map(items.__getitem__, range(self.length, len(items)))
+        for (stop, title), day in zip(new_items, days[self.length:]):
+            if self.days and self.days[-1] == day:
+                start = self._stop
+            else:
+                start = stop
+                self.days.append(day)
+                self.aggregates.append(
+                    Aggregates.from_items([], self.virtual_midnight))
+                self.dates.append({})
+            title, tags = split(title)
+            entry = Entry(start, stop, stop - start, tags, title)
+            self.aggregates[-1].add(entry, day)
+            add_daily_total(self.dates[-1], entry)
+            self._stop = stop
+        self.length = len(items)
+
+    def _rows(self, first_day, last_day):
+        """Return the range of rows of a half-open range of days."""
+        i = bisect_left(self.days, first_day.toordinal())
+        j = bisect_left(self.days, last_day.toordinal(), i)
+        return range(i, j)
+
+    def aggregate(self, first_day, last_day):
+        """Return Aggregates of a range of days.
+
+        The range is half-open (inclusive at ``first_day``, exclusive
+        at ``last_day``).
+        """
+        aggregates = Aggregates.from_items([], self.virtual_midnight)
+        for n in self._rows(first_day, last_day):
+            aggregates.merge(self.aggregates[n])
+        return aggregates
+
+    def daily_totals(self, first_day, last_day):
+        """Return daily_totals() of a range of days.
+
+        The range is half-open (inclusive at ``first_day``, exclusive
+        at ``last_day``).
+        """
+        totals = {}
+        for n in self._rows(first_day, last_day):
+            for date, (started, slacking, work) in self.dates[n].items():
+                day = totals.get(date)
+                if day is None:
+                    totals[date] = [started, slacking, work]
+                else:
+                    day[1] += slacking
+                    day[2] += work
+        return totals
+
+
+class ParseCache(object):
+    """A cache of parsed timelog.txt contents.
+
+    The cache file holds the timestamps of all entries (as integer minutes,
+    see datetime_to_minutes()) in sorted order, together with the positions
+    of entry titles in the decoded file text.
+
+    The cache is keyed by the size, mtime and MD5 hash of the file contents.
+    A cache that describes a prefix of the current file contents is still
+    useful: only the remainder of the file needs to be parsed.
+    """
+
+    MAGIC = b'GTLCACHE'
+    VERSION = 1
+    header = struct.Struct('<8sIQd16sQ')
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def load(self, data, mtime):
+        """Load the cache for file contents ``data``.
+
+        Returns a tuple (size, minutes, starts, stops), where ``size`` is
+        the number of bytes of ``data`` that the cache describes, and the
+        rest are arrays with the timestamp and the entry title position of
+        each item.
+
+        Returns None if there's no usable cache.
+        """
+        try:
+            with open(self.filename, 'rb') as f:
+                header = f.read(self.header.size)
+                magic, version, size, cached_mtime, digest, count = (
+                    self.header.unpack(header))
+                if magic != self.MAGIC or version != self.VERSION:
+                    return None
+                if size > len(data):
+                    return None
+                if (size, cached_mtime) != (len(data), mtime):
+                    # the file was changed; was it only appended to?
+                    if md5(data[:size]).digest() != digest:
+                        return None
+                columns = []
+                for n in range(3):
+                    column = array('q')
+                    column.fromfile(f, count)
+                    columns.append(column)
+        except (IOError, EOFError, ValueError, struct.error):
+            return None
+        return (size, ) + tuple(columns)
+
+    def save(self, data, mtime, minutes, starts, stops):
+        """Save the cache for file contents ``data``.
+
+        ``minutes``, ``starts`` and ``stops`` are sequences of integers
+        with the timestamp and the entry title position of each item.
+
+        Errors are ignored: the cache is only an optimization.
+        """
+        tempname = self.filename + '.tmp'
+        try:
+            header = self.header.pack(self.MAGIC, self.VERSION, len(data),
+                                      mtime, md5(data).digest(), len(minutes))
+            with open(tempname, 'wb') as f:
+                f.write(header)
+                for column in (minutes, starts, stops):
+                    array('q', column).tofile(f)
+            os.replace(tempname, self.filename)
+        except (IOError, struct.error):
+            pass
+
+
 class TimeLog(TimeCollection):
     """Time log.
 
     A time log contains a time window for today, and can add new entries at
     the end.
+
+    If ``compact`` is true, items are kept in CompactItems instead of a list,
+    which uses a lot less memory at the cost of building item tuples on
+    demand.
+
+    If ``use_mmap`` is true, the log file is memory-mapped and entries are
+    only decoded when they're needed (this implies ``compact``, and the
+    parse cache is not used).  The file must not be truncated or modified
+    in place while the items are in use, or the process may crash.  (On
+    Windows this also means remove_last_entry() can't replace the file.)
+
+    If ``since`` is a datetime, only the end of the log file is read,
+    going backwards until an entry older than ``since`` is found.  Such a
+    time log is not ``complete``, and has correct windows only for times
+    after ``since``.  Call reread() to load the rest.
+
+    Once something is appended, the log file is kept open for further
+    appends until it is reloaded or close() is called.  ``fsync`` says
+    whether to make sure new entries are written to disk: never, after
+    every entry, or after every batch of entries.
     """
 
-    def __init__(self, filename, virtual_midnight):
+    FSYNC_NEVER = 'never'
+    FSYNC_ENTRY = 'entry'
+    FSYNC_BATCH = 'batch'
+
+    _append_file = None
+
+    # How many bytes at the start of the file and preceding the end of the
+    # parsed part of the file we remember, to notice when the file was
+    # changed instead of appended to.
+    tail_size = 4096
+
+    # How many recently used windows to keep around.
+    window_cache_size = 16
+
+    # How many bytes to read at first when reading the log file backwards.
+    chunk_size = 65536
+
+    # Windows that span at least this many virtual days are aggregated from
+    # the day_rollup().
+    rollup_min_days = 90
+
+    def __init__(self, filename, virtual_midnight, cache_filename=None,
+                 compact=False, use_mmap=False, since=None,
+                 fsync=FSYNC_NEVER):
+        assert fsync in (self.FSYNC_NEVER, self.FSYNC_ENTRY, self.FSYNC_BATCH)
+        self._windows = collections.OrderedDict()
+        self._day_index = None
+        self._day_rollup = None
+        self.window = None
+        self.use_mmap = use_mmap
+        self.compact = compact or use_mmap
         super(TimeLog, self).__init__(virtual_midnight)
         self.filename = filename
-        self.reread()
+        self.fsync = fsync
+        self.cache = ParseCache(cache_filename) if cache_filename else None
+        # How many times check_reload() found the file 'unchanged', or
+        # reloaded it by reading the 'appended' lines, or had to 'reread'
+        # all of it.
+        self.reload_stats = collections.Counter()
+        if since is None:
+            self.reread()
+        else:
+            self.read_since(since)
 
     def virtual_today(self):
         """Return today's date, adjusted for virtual midnight."""
         return virtual_day(datetime.datetime.now(), self.virtual_midnight)
 
+    @property
+    def virtual_midnight(self):
+        return self._virtual_midnight
+
+    @virtual_midnight.setter
+    def virtual_midnight(self, virtual_midnight):
+        self._virtual_midnight = virtual_midnight
+        self._day_index = None
+        self._day_rollup = None
+        if self.window is not None:
+            self.day = self.virtual_today()
+            self.window = self.window_for_day(self.day)
+
+    def changed(self):
+        """Note that items were changed.
+
+        This invalidates cached derived data, including cached windows.
+        """
+        super(TimeLog, self).changed()
+        self._windows.clear()
+        self._day_index = None
+        self._day_rollup = None
+
     def check_reload(self):
-        """Look at the mtime of timelog.txt, and reload it if necessary.
+        """Look at the mtime and size of timelog.txt, and reload if necessary.
+
+        If the file has only grown since it was last read, only the new
+        lines are parsed.
 
         Returns True if the file was reloaded.
         """
-        mtime = get_mtime(self.filename)
-        if mtime != self.last_mtime:
-            self.reread()
-            return True
-        else:
+        if get_mtime_and_size(self.filename) == (self.last_mtime, self.last_size):
+            self.reload_stats['unchanged'] += 1
             return False
+        if self.read_appended():
+            self.reload_stats['appended'] += 1
+        else:
+            self.reread()
+            self.reload_stats['reread'] += 1
+        return True
 
     def reread(self):
         """Reload the log file."""
+        self.close()
         self.day = self.virtual_today()
-        self.last_mtime = get_mtime(self.filename)
+        self.last_mtime, self.last_size = get_mtime_and_size(self.filename)
+        self._parsed_size = None
+        self._head = self._tail = b''
+        self.complete = True
         try:
             if hasattr(self.filename, 'read'):
                 # accept any file-like object
                 # this is a hook for unit tests, really
                 self.filename.seek(0)
-                self.items = self._read(self.filename)
+                items = self._read(self.filename)
+            elif self.use_mmap:
+                with open(self.filename, 'rb') as f:
+                    data = self._map(f)
+                items = self._read_mapped(data)
+                self._parsed(0, data)
             else:
-                with open(self.filename, encoding='utf-8') as f:
-                    self.items = self._read(f)
+                with open(self.filename, 'rb') as f:
+                    data = f.read()
+                if self.cache is not None:
+                    items = self._read_cached(data)
+                else:
+                    items = self._parse_items(self._decode(data))
+                self._parsed(0, data)
         except IOError:
-            self.items = []
+            items = []
+            # the file might appear later
+            self._parsed(0, b'')
+        self.items = items
         self.window = self.window_for_day(self.day)
 
-    def _read(self, f):
-        items = []
-        for line in f:
-            time, sep, entry = line.partition(': ')
-            if not sep:
-                continue
-            try:
-                time = parse_datetime(time)
-            except ValueError:
-                continue
+    def read_since(self, since):
+        """Load only the end of the log file, with all entries after ``since``.
+
+        The file is read backwards, in growing chunks, until it reaches an
+        entry older than ``since``, so this takes about the same time no
+        matter how long the log file is.
+        """
+        if hasattr(self.filename, 'read') or self.cache is not None:
+            # nothing to gain here
+            self.reread()
+            return
+        self.day = self.virtual_today()
+        self.last_mtime, self.last_size = get_mtime_and_size(self.filename)
+        self._parsed_size = None
+        self._head = self._tail = b''
+        limit = datetime_to_minutes(since)
+        offset = 0
+        data = b''
+        try:
+            with open(self.filename, 'rb') as f:
+                for offset, data in self._read_backwards(f):
+                    first = self._first_timestamp(data)
+                    if first is not None and first < limit:
+                        break
+        except IOError:
+            pass
+        self.items = self._parse_items(self._decode(data))
+        self._parsed(offset, data)
+        self.complete = offset == 0
+        self.window = self.window_for_day(self.day)
+
+    def _read_backwards(self, f):
+        """Read a file backwards, in growing chunks.
+
+        Yields (offset, data) tuples, where ``data`` are all the complete
+        lines from ``offset`` to the end of the file.  The last one has
+        offset 0.
+        """
+        offset = f.seek(0, os.SEEK_END)
+        data = b''
+        chunk_size = self.chunk_size
+        while offset > 0:
+            start = max(0, offset - chunk_size)
+            f.seek(start)
+            data = f.read(offset - start) + data
+            offset = start
+            chunk_size *= 2
+            if offset > 0:
+                # skip the incomplete first line
+                pos = data.find(b'\n') + 1
+                if not pos:
+                    continue
+                offset += pos
+                data = data[pos:]
+            yield offset, data
+
+    @classmethod
+    def _first_timestamp(cls, data):
+        """Return the timestamp of the first entry in log file contents.
+
+        Returns None if there are no entries.
+        """
+        parse_timestamp = timestamp_parser()
+        for m in cls._byte_line_rx.finditer(data):
+            date, hhmm, entry, line = m.groups()
+            if line is None:
+                time = parse_timestamp(date, hhmm)
+                if time >= 0:
+                    return time
+            else:
+                time, sep, entry = line.partition(b': ')
+                if not sep:
+                    continue
+                try:
+                    return datetime_to_minutes(
+                        parse_datetime(time.decode('utf-8', 'replace')))
+                except ValueError:
+                    continue
+        return None
+
+    def read_appended(self):
+        """Parse lines appended to the log file since it was last read.
+
+        Returns False, without changing anything, if the file didn't grow or
+        was modified in some other way and needs to be reread from scratch.
+        Only the start of the file and the end of the part that was already
+        parsed are compared, so an edit in between that also makes the file
+        grow goes unnoticed.
+        """
+        if self._parsed_size is None:
+            return False
+        mtime, size = get_mtime_and_size(self.filename)
+        if size is None or size <= self._parsed_size:
+            return False
+        try:
+            with open(self.filename, 'rb') as f:
+                if f.read(len(self._head)) != self._head:
+                    return False
+                start = self._parsed_size - len(self._tail)
+                f.seek(start)
+                if f.read(len(self._tail)) != self._tail:
+                    return False
+                data = f.read()
+        except IOError: # pragma: nocover
+            # it was removed just now
+            return False
+        self.close()
+        self.day = self.virtual_today()
+        self.last_mtime, self.last_size = mtime, size
+        new_items = self._read_text(self._decode(data))
+        if not self.items or not new_items or new_items[0][0] >= self.items[-1][0]:
+            self._extend(new_items)
+            self.changed()
+        else:
+            self.items = sorted(list(self.items) + new_items,
+                                key=itemgetter(0))
+        self._parsed(self._parsed_size, data)
+        self.window = self.window_for_day(self.day)
+        return True
+
+    @TimeCollection.items.setter
+    def items(self, items):
+        # items must be sorted
+        if self.compact:
+            if not isinstance(items, CompactItems):
+                items = CompactItems(items)
+            self._timestamps = items.timestamps
+        else:
+            self._timestamps = [item[0] for item in items]
+        TimeCollection.items.fset(self, items)
+
+    def _extend(self, new_items):
+        """Add items at the end.
+
+        The caller is responsible for keeping items sorted and calling
+        changed().
+        """
+        self.items.extend(new_items)
+        if not self.compact:
+            # in compact mode self._timestamps is a view of self.items
+            self._timestamps.extend(item[0] for item in new_items)
+
+    def _parsed(self, offset, data):
+        """Remember how much of the log file was parsed.
+
+        ``data`` are the bytes that were read starting at ``offset``.
+        """
+        if data and data[-1:] != b'\n':
+            # we can't append to an incomplete last line
+            self._parsed_size = None
+            self._head = self._tail = b''
+        else:
+            if offset == 0:
+                self._head = data[:self.tail_size]
+            self._parsed_size = offset + len(data)
+            self._tail = (self._tail + data[-self.tail_size:])[-self.tail_size:]
+
+    @staticmethod
+    def _decode(data):
+        """Decode the log file contents.
+
+        Newlines are translated the same way as when reading the file in
+        text mode.
+        """
+        text = data.decode('utf-8')
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        return text
+
+    def _read_cached(self, data):
+        """Parse the log file contents with the help of the parse cache.
+
+        Only the part of the file that was added since the cache was last
+        saved needs to be parsed.  The cache is then updated.
+        """
+        mtime = get_mtime(self.filename)
+        cached = self.cache.load(data, mtime)
+        if cached is None:
+            cached_size, minutes, starts, stops = 0, [], [], []
+        else:
+            cached_size, minutes, starts, stops = cached
+        text = self._decode(data[:cached_size])
+        entries = [text[start:stop] for start, stop in zip(starts, stops)]
+        if cached is None or cached_size < len(data):
+            new_minutes, new_entries, new_starts, new_stops = self._parse(
+                self._decode(data[cached_size:]), len(text))
+            out_of_order = (minutes and new_minutes
+                            and new_minutes[0] < minutes[-1])
+            entries.extend(new_entries)
+            minutes = list(minutes)
+            minutes.extend(new_minutes)
+            starts = list(starts)
+            starts.extend(new_starts)
+            stops = list(stops)
+            stops.extend(new_stops)
+            if out_of_order:
+                order = sorted(range(len(entries)), key=minutes.__getitem__)
+                entries = [entries[i] for i in order]
+                minutes = [minutes[i] for i in order]
+                starts = [starts[i] for i in order]
+                stops = [stops[i] for i in order]
+            if not data or data.endswith(b'\n'):
+                # an incomplete last line might still change, so a cache
+                # must always end at a line boundary
+                self.cache.save(data, mtime, minutes, starts, stops)
+        return self._make_items(minutes, entries)
+
+    def _make_items(self, minutes, entries):
+        """Build items from parallel sequences of minutes and entries."""
+        if self.compact:
+            return CompactItems.from_columns(minutes, entries)
+        return list(zip(minutes_to_datetimes(minutes), entries))
+
+    def _parse_items(self, text):
+        """Parse the text of a log file into sorted items."""
+        if self.compact:
+            minutes, entries = self._parse(text)[:2]
+            return CompactItems.from_columns(minutes, entries)
+        return self._read_text(text)
+
+    # A line is either a well-formed entry, which we can parse quickly, or
+    # something else that needs a closer look.
+    _line_rx = re.compile(
+        r'^(?:(\d{4}-\d\d-\d\d) (\d\d:\d\d): (.*)|(.*))$',
+        re.MULTILINE | re.ASCII)
+
+    @classmethod
+    def _parse(cls, text, pos=0):
+        """Parse the text of a log file.
+
+        Returns a tuple of four parallel lists (minutes, entries, starts,
+        stops), sorted by time.  ``minutes`` are the timestamps, as returned
+        by datetime_to_minutes().  ``starts`` and ``stops`` are the
+        character offsets of each entry in the text, counting from ``pos``.
+
+        Lines that can't be parsed are skipped.
+        """
+        minutes = []
+        entries = []
+        starts = []
+        stops = []
+        parse_timestamp = timestamp_parser()
+        for m in cls._line_rx.finditer(text):
+            date, hhmm, entry, line = m.groups()
+            if line is None:
+                time = parse_timestamp(date, hhmm)
+                if time < 0:
+                    continue
+            else:
+                # be exactly as lenient as parse_datetime() is
+                time, sep, entry = line.partition(': ')
+                if not sep:
+                    continue
+                try:
+                    time = datetime_to_minutes(parse_datetime(time))
+                except ValueError:
+                    continue
+            start = pos + m.end() - len(entry.lstrip())
             entry = entry.strip()
-            items.append((time, entry))
+            minutes.append(time)
+            entries.append(entry)
+            starts.append(start)
+            stops.append(start + len(entry))
         # There's code that relies on entries being sorted.  The entries really
         # should be already sorted in the file, but sometimes the user edits
         # timelog.txt directly and introduces errors.
@@ -964,16 +2313,201 @@ class TimeLog(TimeCollection):
         # there are errors
         # Note that we must preserve the relative order of entries with
         # the same timestamp: https://bugs.launchpad.net/gtimelog/+bug/708825
+        if any(a > b for a, b in zip(minutes, minutes[1:])):
+            order = sorted(range(len(minutes)), key=minutes.__getitem__)
+            minutes = [minutes[i] for i in order]
+            entries = [entries[i] for i in order]
+            starts = [starts[i] for i in order]
+            stops = [stops[i] for i in order]
+        return minutes, entries, starts, stops
+
+    @staticmethod
+    def _map(f):
+        """Memory-map a file opened for reading."""
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            return b''
+
+    # The same as _line_rx, but for bytes
+    _byte_line_rx = re.compile(
+        rb'^(?:(\d{4}-\d\d-\d\d) (\d\d:\d\d): (.*)|(.*))$', re.MULTILINE)
+
+    def _read_mapped(self, data):
+        """Parse the log file contents without decoding entries.
+
+        ``data`` is the memory-mapped log file.  Only the timestamps are
+        parsed; entries are left for CompactItems to decode on demand.
+
+        Returns CompactItems sorted by time.
+        """
+        if re.search(rb'\r(?!\n)', data):
+            # old Mac line endings; not worth optimizing for
+            minutes, entries = self._parse(self._decode(data[:]))[:2]
+            return self._make_items(minutes, entries)
+        minutes = []
+        ranges = []
+        parse_timestamp = timestamp_parser()
+        for m in self._byte_line_rx.finditer(data):
+            date, hhmm, entry, line = m.groups()
+            if line is None:
+                time = parse_timestamp(date, hhmm)
+                if time < 0:
+                    continue
+                start = m.start(3)
+            else:
+                # be exactly as lenient as parse_datetime() is; note that
+                # b': ' can't occur inside a multibyte UTF-8 character
+                time, sep, entry = line.partition(b': ')
+                if not sep:
+                    continue
+                try:
+                    time = datetime_to_minutes(parse_datetime(time.decode('utf-8')))
+                except ValueError:
+                    continue
+                start = m.end() - len(entry)
+            minutes.append(time)
+            ranges.append(start)
+            ranges.append(m.end())
+        items = CompactItems.from_buffer(data, minutes, ranges)
+        if any(a > b for a, b in zip(minutes, minutes[1:])):
+            # keep the relative order of entries with the same timestamp
+            order = sorted(range(len(minutes)), key=minutes.__getitem__)
+            items.minutes = array('q', [minutes[i] for i in order])
+            items.entry_ids = array('i', [-1 - i for i in order])
+        return items
+
+    # Lines that look like "time: entry", where the time is either
+    # well-formed or needs a closer look.
+    _entry_rx = re.compile(
+        r'^(?:(\d{4}-\d\d-\d\d \d\d:\d\d)|(.*?)): (.*)$',
+        re.MULTILINE | re.ASCII)
+
+    @classmethod
+    def _read_text(cls, text):
+        """Parse the text of a log file into a sorted list of items.
+
+        Unlike _parse(), this doesn't work out minutes or entry offsets,
+        and when all timestamps are well-formed, converts them to datetimes
+        without a Python loop.
+        """
+        found = cls._entry_rx.findall(text)
+        stamps = list(map(itemgetter(0), found))
+        times = None
+        if '' not in stamps:
+            try:
+                times = list(map(datetime.datetime.fromisoformat, stamps))
+            except ValueError:
+                # e.g. 2018-02-30
+                pass
+        if times is not None:
+            items = list(zip(times, map(str.strip, map(itemgetter(2), found))))
+        else:
+            # be exactly as lenient as parse_datetime() is
+            items = []
+            for stamp, time, entry in found:
+                try:
+                    time = parse_datetime(stamp or time)
+                except ValueError:
+                    continue
+                items.append((time, entry.strip()))
+        # Keep the relative order of entries with the same timestamp, like
+        # _parse() does.
         items.sort(key=itemgetter(0))
         return items
 
+    def _read(self, f):
+        return self._read_text(f.read())
+
+    def items_between(self, min_timestamp, max_timestamp):
+        """Return a sequence of items in a time interval.
+
+        The interval is half-open (inclusive at ``min_timestamp``, exclusive
+        at ``max_timestamp``).
+
+        Since items are sorted, this uses a binary search over their
+        timestamps (or over the index of virtual days, if the interval
+        starts and ends at virtual midnight), and returns an ItemSlice
+        instead of copying them.
+        """
+        if (self.items
+                and min_timestamp.time() == self.virtual_midnight
+                and max_timestamp.time() == self.virtual_midnight):
+            start, stop = self.day_index().slice(min_timestamp.date(),
+                                                 max_timestamp.date())
+            return ItemSlice(self.items, self._timestamps, start, stop)
+        return ItemSlice(self.items, self._timestamps).between(
+            min_timestamp, max_timestamp)
+
+    def _compute_day_ordinals(self):
+        index = self.day_index()
+        days = array('i')
+        for n, day in enumerate(index.days):
+            days.extend(array('i', [day]) * (index._start(n + 1) - index.starts[n]))
+        return days
+
+    def day_index(self):
+        """Return a DayIndex of all items.
+
+        It's built when first needed, and kept up to date as items are
+        appended.
+        """
+        index = self._day_index
+        if index is None:
+            index = self._day_index = DayIndex(self.virtual_midnight)
+        index.update(self._timestamps)
+        return index
+
+    def day_rollup(self):
+        """Return a DayRollup of all items.
+
+        It's built when first needed, and kept up to date as items are
+        appended.
+        """
+        rollup = self._day_rollup
+        if rollup is None:
+            rollup = self._day_rollup = DayRollup(self.virtual_midnight)
+        rollup.update(self.items, self.day_ordinals())
+        return rollup
+
+    def _rollup_for(self, window):
+        """Return a DayRollup that can aggregate a window, or None.
+
+        That's the case for windows of whole virtual days that span at
+        least rollup_min_days.
+        """
+        min, max = window.min_timestamp, window.max_timestamp
+        items = window.items
+        if not (self.items and isinstance(items, ItemSlice)
+                and items._items is self.items
+                and window.virtual_midnight == self.virtual_midnight
+                and (max - min).days >= self.rollup_min_days
+                and min.time() == max.time() == self.virtual_midnight):
+            return None
+        if (items.start, items.stop) != self.day_index().slice(min.date(),
+                                                                max.date()):
+            return None # pragma: nocover
+        return self.day_rollup()
+
     def window_for(self, min, max):
         """Return a TimeWindow for a specified time interval.
 
         ``min`` and ``max`` should be datetime.datetime instances.  The
         interval is half-open (inclusive at ``min``, exclusive at ``max``).
+
+        Recently used windows (and their aggregates) are cached until the
+        time log changes.  Do not modify them.
         """
-        return TimeWindow(self, min, max)
+        key = (min, max, self.virtual_midnight)
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = TimeWindow(self, min, max)
+            if len(self._windows) > self.window_cache_size:
+                self._windows.popitem(last=False)
+        else:
+            self._windows.move_to_end(key)
+        return window
 
     def window_for_day(self, date):
         """Return a TimeWindow for the specified day."""
@@ -1009,54 +2543,297 @@ class TimeLog(TimeCollection):
         max = max + datetime.timedelta(1)
         return self.window_for(min, max)
 
+    def stream_window(self, min, max):
+        """Return a StreamedWindow for a specified time interval.
+
+        This is meant for reports of long periods.
+        """
+        return StreamedWindow(self.items_between(min, max), min, max,
+                              self.virtual_midnight)
+
     def remove_last_entry(self):
+        """Comment out the last entry in the log file.
+
+        Only the end of the file is read, and items are updated without
+        rereading the file.  The file is still copied as a whole (see
+        _rewrite()), so this takes time proportional to its size.
+
+        Returns the removed entry, or None if today's window is empty.
+        """
         self.check_reload()
         if not self.window.items:
             # last day's entries list is empty, so nothing to remove
             return None
-        with open(self.filename, "r", encoding='utf-8') as f:
-            lines = f.readlines()
-        for idx, line in enumerate(reversed(lines), start=1):
-            time, sep, entry = line.partition(': ')
+        with open(self.filename, 'rb') as f:
+            scanned = 0
+            for offset, data in self._read_backwards(f):
+                found = self._last_entry_line(data, len(data) - scanned)
+                if found is not None:
+                    break
+                scanned = len(data)
+            else:
+                # maybe timelog.txt got replaced after we did check_reload()
+                # but before we re-read it?
+                return None  # pragma: nocover
+        pos, time, last_entry = found
+        self._rewrite(offset, data[:pos] + b'##' + data[pos:])
+        # Entries with the same timestamp keep their order in the file, so
+        # the last matching one is the one we've just commented out.
+        first = bisect_left(self._timestamps, time)
+        for idx in reversed(range(first, bisect_right(self._timestamps, time))):
+            if self.items[idx][1] == last_entry:
+                break
+        else:  # pragma: nocover
+            self.reread()
+            return last_entry
+        # build new items so existing ItemSlice views remain valid
+        items = self.items.copy()
+        del items[idx]
+        self.items = items
+        self.window = self.window_for(self.window.min_timestamp,
+                                      self.window.max_timestamp)
+        return last_entry
+
+    def _rewrite(self, offset, data):
+        """Replace the log file contents after ``offset`` with ``data``.
+
+        The new contents are written to a temporary file that then replaces
+        the log file, so a crash can't leave the log file half-written.
+        The price is copying the whole file, even when only its end changes:
+        editing it in place would be cheaper, but not safe.
+
+        The size, mtime and tail of the file are updated, so check_reload()
+        won't reload it because of this.
+        """
+        self.close()
+        # don't replace a symlink with a regular file
+        filename = os.path.realpath(self.filename)
+        dirname, basename = os.path.split(filename)
+        fd, tempname = tempfile.mkstemp(prefix='.%s.' % basename, dir=dirname)
+        try:
+            with open(fd, 'wb') as new, open(filename, 'rb') as old:
+                remaining = offset
+                while remaining > 0:
+                    chunk = old.read(min(remaining, self.chunk_size))
+                    if not chunk:  # pragma: nocover
+                        raise IOError('%s was truncated' % filename)
+                    new.write(chunk)
+                    remaining -= len(chunk)
+                new.write(data)
+                new.flush()
+                os.fsync(new.fileno())
+                st = os.fstat(new.fileno())
+            shutil.copymode(filename, tempname)
+            os.replace(tempname, filename)
+        except BaseException:
+            os.unlink(tempname)
+            raise
+        fsync_dir(dirname)
+        self.last_mtime = st.st_mtime
+        self.last_size = st.st_size
+        self._parsed_size = None
+        self._head = self._head[:offset]
+        self._tail = b''
+        self._parsed(offset, data)
+
+    @staticmethod
+    def _last_entry_line(data, end):
+        """Find the last entry in data[:end].
+
+        Returns (offset, time, entry), where ``offset`` is the start of the
+        line, or None.
+        """
+        pos = end
+        for line in reversed(data[:end].splitlines(True)):
+            pos -= len(line)
+            time, sep, entry = line.decode('utf-8').partition(': ')
             if not sep:
                 continue
             try:
                 time = parse_datetime(time)
             except ValueError:
                 continue
-            last_entry = entry.strip()
-            break
-        else:
-            # maybe timelog.txt got replaced after we did check_reload() but
-            # before we re-read it?
-            return None  # pragma: nocover
-        lines[-idx] = '##' + lines[-idx]
-        with open(self.filename, "w", encoding='utf-8') as f:
-            f.writelines(lines)
-        self.reread()
-        return last_entry
+            return pos, time, entry.strip()
+        return None
+
+    def close(self):
+        """Close the log file if it was kept open for appending."""
+        if self._append_file is not None:
+            self._append_file.close()
+            self._append_file = None
+
+    def __del__(self):
+        self.close()
 
     def raw_append(self, line, need_space):
         """Append a line to the time log file."""
-        with open(self.filename, "a", encoding='utf-8') as f:
-            if need_space:
-                f.write('\n')
-            f.write(line + '\n')
-        self.last_mtime = get_mtime(self.filename)
+        self._write(['%s%s\n' % ('\n' if need_space else '', line)])
+
+    def _write(self, texts):
+        """Append lines of text to the time log file.
+
+        The file is kept open for further appends.  Its new size and mtime
+        are remembered, so check_reload() won't reload it because of this.
+        """
+        if self._append_file is None:
+            self._append_file = open(self.filename, 'ab')
+        f = self._append_file
+        chunks = [text.replace('\n', os.linesep).encode('utf-8')
+                  for text in texts]
+        if self.fsync == self.FSYNC_ENTRY:
+            for chunk in chunks:
+                f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+        else:
+            f.write(b''.join(chunks))
+            f.flush()
+            if self.fsync == self.FSYNC_BATCH:
+                os.fsync(f.fileno())
+        st = os.fstat(f.fileno())
+        self.last_mtime = st.st_mtime
+        self.last_size = st.st_size
+        if self._parsed_size is not None:
+            data = b''.join(chunks)
+            if st.st_size == self._parsed_size + len(data):
+                self._parsed(self._parsed_size, data)
+            else:  # pragma: nocover
+                # somebody else wrote to the file at the same time
+                self._parsed_size = None
 
     def append(self, entry, now=None):
         """Append a new entry to the time log."""
+        self.append_many([(now, entry)])
+
+    def append_many(self, entries):
+        """Append several new entries to the time log.
+
+        ``entries`` is a sequence of (now, entry) tuples.  ``now`` can be
+        None to use the current time.
+
+        The log file is checked for outside changes and written to once.
+        """
+        self._check_before_append()
+        texts = [self._add(entry, now) for now, entry in entries]
+        if texts:
+            self._write(texts)
+
+    def _check_before_append(self):
+        """Reload the log file before appending, if necessary.
+
+        While the file is kept open for appending, it is reloaded if the
+        file name no longer refers to the open file (e.g. an editor saved a
+        new file over it), so we never write to a replaced file.
+        """
+        f = self._append_file
+        if f is None:
+            self.check_reload()
+            return
+        st = os.fstat(f.fileno())
+        try:
+            replaced = not os.path.samestat(st, os.stat(self.filename))
+        except OSError:
+            replaced = True
+        if replaced:
+            self.reread()
+            self.reload_stats['reread'] += 1
+        elif (st.st_mtime, st.st_size) != (self.last_mtime, self.last_size):
+            self.check_reload()
+        else:
+            self.reload_stats['unchanged'] += 1
+
+    def _add(self, entry, now):
+        """Add a new entry to items.
+
+        Returns the text that should be appended to the log file.
+        """
         if not now:
             now = datetime.datetime.now().replace(second=0, microsecond=0)
-        self.check_reload()
         need_space = False
         last = self.last_time()
         if last and different_days(now, last, self.virtual_midnight):
             need_space = True
-        self.items.append((now, entry))
-        self.window.items.append((now, entry))
+        if not self.items or now >= self.items[-1][0]:
+            self._extend([(now, entry)])
+            self._appended()
+        else:
+            # keep items sorted, placing the new one after any others with
+            # the same timestamp, exactly like reread() would; build new lists
+            # so existing ItemSlice views remain valid
+            idx = bisect_right(self._timestamps, now)
+            items = self.items.copy()
+            items.insert(idx, (now, entry))
+            self.items = items
+            self.window = self.window_for(self.window.min_timestamp,
+                                          self.window.max_timestamp)
         line = '%s: %s' % (now.strftime("%Y-%m-%d %H:%M"), entry)
-        self.raw_append(line, need_space)
+        return '%s%s\n' % ('\n' if need_space else '', line)
+
+    def _appended(self):
+        """Update cached data after one item was appended at the end.
+
+        Instead of being discarded, cached aggregates are updated
+        incrementally, and cached windows that should include the new item
+        are replaced with extended copies.
+        """
+        old_length = len(self.items) - 1
+        key = (self.version, self.virtual_midnight, old_length)
+        self.version += 1
+        new_key = self._cache_key()
+        if self._day_ordinals is not None and self._day_ordinals[0] == key:
+            days = self._day_ordinals[1]
+            days.append(virtual_day(self.items[-1][0],
+                                    self.virtual_midnight).toordinal())
+            self._day_ordinals = (new_key, days)
+        if self._aggregates is not None and self._aggregates[0] == key:
+            aggregates = self._aggregates[1]
+            aggregates.add(self.last_entry())
+            self._aggregates = (new_key, aggregates)
+        now = self.items[-1][0]
+        for key, window in list(self._windows.items()):
+            if now >= window.max_timestamp:
+                continue
+            if (self._at_end(window, old_length)
+                    and window.min_timestamp <= now):
+                self._windows[key] = self._extended(window)
+            else:
+                # the window no longer ends at the end of the items, so it
+                # wouldn't get items appended later
+                del self._windows[key]
+        if (self._at_end(self.window, old_length)
+                and self.window.min_timestamp <= now):
+            # Today's window always gets the new item, even if it's already
+            # past virtual midnight.
+            key = (self.window.min_timestamp, self.window.max_timestamp,
+                   self.window.virtual_midnight)
+            window = self._windows.get(key)
+            if window is None or not self._at_end(window, old_length + 1):
+                window = self._extended(self.window)
+            self.window = window
+        elif now < self.window.max_timestamp:
+            self.window = self.window_for(self.window.min_timestamp,
+                                          self.window.max_timestamp)
+
+    def _at_end(self, window, length):
+        """Is window a view of the first ``length`` items?"""
+        items = window.items
+        return (isinstance(items, ItemSlice) and items._items is self.items
+                and items.stop == length)
+
+    def _extended(self, window):
+        """Return a copy of a window extended with the last item."""
+        items = window.items
+        new_window = TimeWindow(
+            self, window.min_timestamp, window.max_timestamp,
+            items=ItemSlice(self.items, self._timestamps, items.start,
+                            items.stop + 1))
+        new_window.virtual_midnight = window.virtual_midnight
+        aggregates = window._cached_aggregates()
+        if aggregates is not None:
+            aggregates = aggregates.copy()
+            aggregates.add(new_window.last_entry())
+            new_window._aggregates = (new_window._cache_key(), aggregates)
+        return new_window
 
     def valid_time(self, time):
         """Is this a valid time for a correction?
@@ -1113,6 +2890,275 @@ class TimeLog(TimeCollection):
         return entry, now
 
 
+def shard_filename(dirname, year):
+    """Return the name of the file that has the entries of a given year."""
+    return os.path.join(dirname, '%04d.txt' % year)
+
+
+def split_timelog(filename, dirname):
+    """Split a log file into one file per year, for ShardedTimeLog.
+
+    Entries go into the file of the year of their timestamp; other lines
+    (comments, blank lines) go together with the entry before them.  The
+    original file is not changed.
+
+    Returns a list of the files that were created.
+
+    Refuses to overwrite existing files.
+    """
+    shards = collections.OrderedDict()
+    year = None
+    with open(filename, encoding='utf-8') as f:
+        for line in f:
+            time, sep, entry = line.partition(': ')
+            if sep:
+                try:
+                    year = parse_datetime(time).year
+                except ValueError:
+                    pass
+            shards.setdefault(year, []).append(line)
+    if None in shards:
+        # lines before the first entry
+        lines = shards.pop(None)
+        if shards:
+            first = next(iter(shards))
+            shards[first][:0] = lines
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    created = []
+    for year, lines in sorted(shards.items()):
+        shard = shard_filename(dirname, year)
+        with open(shard, 'x', encoding='utf-8') as f:
+            f.writelines(lines)
+        created.append(shard)
+    return created
+
+
+class ShardedTimeLog(TimeLog):
+    """Time log split into one file per year.
+
+    ``dirname`` is a directory of files named YYYY.txt (see split_timelog())
+    with the entries whose timestamps fall into that year.
+
+    ``filename`` is the shard of the current year, where new entries are
+    appended.  Older shards are loaded only when a window needs them, so
+    ``items`` has the entries of the loaded shards only.  Entries in the
+    wrong shard are not lost, but windows don't notice them, unless they
+    are in the current shard.
+
+    At most ``shard_cache_size`` older shards are kept in memory; the
+    least recently used ones are unloaded when more are needed.
+
+    New entries are appended to the current shard, unless they are
+    back-dated to an earlier year (e.g. a correction made just after New
+    Year): those go to the shard of their year.
+
+    Only the last entry in the current shard can be removed.
+    """
+
+    _shard_rx = re.compile(r'^\d{4}[.]txt$')
+
+    # How many older shards to keep loaded.
+    shard_cache_size = 3
+
+    def __init__(self, dirname, virtual_midnight, compact=False):
+        self.dirname = dirname
+        # year -> ((mtime, size), number of items) of loaded older shards,
+        # least recently used first
+        self._history = collections.OrderedDict()
+        super(ShardedTimeLog, self).__init__(
+            shard_filename(dirname, self.current_year()), virtual_midnight,
+            compact=compact)
+
+    def current_year(self):
+        return datetime.datetime.now().year
+
+    def shard_years(self):
+        """Return a sorted list of years that have shard files."""
+        try:
+            names = os.listdir(self.dirname)
+        except OSError:
+            return []
+        return sorted(int(name[:4]) for name in names
+                      if self._shard_rx.match(name))
+
+    def check_reload(self):
+        """Look at the shard files, and reload them if necessary.
+
+        Returns True if anything was reloaded.
+        """
+        if (self.filename != shard_filename(self.dirname, self.current_year())
+                or any(get_mtime_and_size(shard_filename(self.dirname, year))
+                       != state for year, (state, count)
+                       in self._history.items())):
+            self.reread()
+            self.reload_stats['reread'] += 1
+            return True
+        return super(ShardedTimeLog, self).check_reload()
+
+    def _check_before_append(self):
+        if self.filename != shard_filename(self.dirname, self.current_year()):
+            # new entries go to a new shard
+            self.check_reload()
+        else:
+            super(ShardedTimeLog, self)._check_before_append()
+
+    def append_many(self, entries):
+        self._check_before_append()
+        current = self.current_year()
+        texts = []
+        for now, entry in entries:
+            if now and now.year < current:
+                self._append_to_shard(entry, now)
+            else:
+                texts.append(self._add(entry, now))
+        if texts:
+            self._write(texts)
+
+    def _append_to_shard(self, entry, now):
+        """Append a back-dated entry to the shard of an earlier year."""
+        self.check_reload()
+        filename = shard_filename(self.dirname, now.year)
+        # make sure the shard exists, so it gets loaded
+        open(filename, 'ab').close()
+        self._load_shards(now.year, now.year)
+        text = self._add(entry, now)
+        with open(filename, 'ab') as f:
+            f.write(text.replace('\n', os.linesep).encode('utf-8'))
+            if self.fsync != self.FSYNC_NEVER:
+                f.flush()
+                os.fsync(f.fileno())
+        state, count = self._history[now.year]
+        self._history[now.year] = (get_mtime_and_size(filename), count + 1)
+
+    def reread(self):
+        """Reload the current shard, and forget all older shards."""
+        self.filename = shard_filename(self.dirname, self.current_year())
+        self._history = collections.OrderedDict()
+        self.window = None
+        super(ShardedTimeLog, self).reread()
+        self._check_complete()
+
+    def _check_complete(self):
+        current = self.current_year()
+        self.complete = all(year in self._history or year >= current
+                            for year in self.shard_years())
+
+    def window_for(self, min, max):
+        """Return a TimeWindow for a specified time interval.
+
+        Loads the shards of the years that the interval touches.
+        """
+        self._load_shards(min.year, (max - datetime.timedelta(minutes=1)).year)
+        return super(ShardedTimeLog, self).window_for(min, max)
+
+    def stream_window(self, min, max):
+        """Return a StreamedWindow for a specified time interval.
+
+        Older shards are read one at a time, without loading them, so only
+        the largest one needs to fit in memory.
+        """
+        return StreamedWindow(self._stream_items(min, max), min, max,
+                              self.virtual_midnight)
+
+    def _stream_items(self, min, max):
+        current = self.current_year()
+        for year in self.shard_years():
+            if not (min.year <= year <= max.year and year < current):
+                continue
+            if year in self._history:
+                items = self.items_between(datetime.datetime(year, 1, 1),
+                                           datetime.datetime(year + 1, 1, 1))
+            else:
+                items = self._read_shard(year)
+            for item in items:
+                if min <= item[0] < max:
+                    yield item
+        start = datetime.datetime(current, 1, 1)
+        if start < max:
+            yield from self.items_between(min if min > start else start, max)
+
+    def _load_shards(self, first_year, last_year):
+        """Make sure the shards of years in a closed range are loaded."""
+        current = self.current_year()
+        needed = [year for year in self.shard_years()
+                  if first_year <= year <= last_year and year < current]
+        for year in needed:
+            if year in self._history:
+                self._history.move_to_end(year)
+        years = [year for year in needed if year not in self._history]
+        if not years:
+            return
+        items = []
+        for year in years:
+            state = get_mtime_and_size(shard_filename(self.dirname, year))
+            count = len(items)
+            items.extend(self._read_shard(year))
+            self._history[year] = (state, len(items) - count)
+        items.extend(self._unload_shards(len(needed)))
+        items.sort(key=itemgetter(0))
+        self.items = items
+        self._check_complete()
+        if self.window is not None:
+            self.window = super(ShardedTimeLog, self).window_for(
+                self.window.min_timestamp, self.window.max_timestamp)
+
+    def _unload_shards(self, keep):
+        """Unload the least recently used older shards, if there are too many.
+
+        The ``keep`` most recently used shards are kept in any case.
+
+        Returns the remaining items.
+        """
+        unload = min(len(self._history) - self.shard_cache_size,
+                     len(self._history) - keep)
+        if unload <= 0:
+            return self.items
+        ranges = []
+        for i in range(unload):
+            year, (state, count) = self._history.popitem(last=False)
+            start = bisect_left(self._timestamps, datetime.datetime(year, 1, 1))
+            stop = bisect_left(self._timestamps,
+                               datetime.datetime(year + 1, 1, 1), start)
+            ranges.append((start, stop, year, count))
+        ranges.sort()
+        items = []
+        pos = 0
+        for start, stop, year, count in ranges:
+            items.extend(ItemSlice(self.items, self._timestamps, pos, start))
+            if stop - start != count:
+                # Entries from the current shard can fall into this year, so
+                # we can't just drop the whole range.
+                drop = collections.Counter(self._read_shard(year))
+                for item in ItemSlice(self.items, self._timestamps,
+                                      start, stop):
+                    if drop[item]:
+                        drop[item] -= 1
+                    else:
+                        items.append(item)
+            pos = stop
+        items.extend(ItemSlice(self.items, self._timestamps, pos))
+        return items
+
+    def _read_shard(self, year):
+        """Parse an older shard.
+
+        Returns a list of its items that fall into its own year.
+        """
+        with open(shard_filename(self.dirname, year), 'rb') as f:
+            items = self._read_text(self._decode(f.read()))
+        start = datetime.datetime(year, 1, 1)
+        stop = datetime.datetime(year + 1, 1, 1)
+        return [item for item in items if start <= item[0] < stop]
+
+    def remove_last_entry(self):
+        self.check_reload()
+        if not os.path.exists(self.filename):
+            # nothing was logged this year
+            return None
+        return super(ShardedTimeLog, self).remove_last_entry()
+
+
 class TaskList(object):
     """Task list.
 